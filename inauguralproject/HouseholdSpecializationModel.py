@@ -1,8 +1,14 @@
 
 from types import SimpleNamespace
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Manager
+import pickle
+import time
 
 import numpy as np
 from scipy import optimize
+from scipy.interpolate import RegularGridInterpolator
 
 import pandas as pd 
 import matplotlib.pyplot as plt
@@ -36,7 +42,27 @@ class HouseholdSpecializationModelClass:
         par.beta0_target = 0.4      
         par.beta1_target = -0.1
 
-        # f. solution
+        # f. discrete solver
+        par.n_grid = 49             # grid points per hour choice on [0,24]
+        par.chunk_size = 2**16      # grid points evaluated at a time in solve_discrete_chunked
+        par.adaptive_n = 3          # grid points per hour choice in each level of solve_discrete_adaptive
+        par.adaptive_zoom = 0.6     # half-width of each following level there, in grid steps of the level before
+        par.adaptive_depth = 30     # number of levels in solve_discrete_adaptive
+        par.fused = False           # use calc_utility_fused in solve_discrete and solve_discrete_chunked
+        par.fused_dtype = 'float64' # precision of calc_utility_fused there, 'float64' or 'float32'
+
+        # g. continuous solver
+        par.warm_start = False      # seed solve() from earlier solutions in solve_wF_vec
+        par.warm_ftol = 1e-8        # SLSQP tolerance used when warm starting, tighter than cold starts (1e-6)
+        par.n_workers = 1           # processes the wages in solve_wF_vec are spread over
+
+        # h. estimation
+        par.cache_size = 1024       # max. number of parameter sets kept in the estimation cache, 0 disables it
+
+        # i. instrumentation
+        par.instrument = False      # collect counters and timings in self.stats
+
+        # j. solution
         sol.LM_vec = np.zeros(par.wF_vec.size)
         sol.HM_vec = np.zeros(par.wF_vec.size)
         sol.LF_vec = np.zeros(par.wF_vec.size)
@@ -45,44 +71,237 @@ class HouseholdSpecializationModelClass:
         sol.beta0 = np.nan
         sol.beta1 = np.nan
 
+        sol.x0 = None               # initial guess for solve(), set by solve_household when warm starting
+        sol.warm = SimpleNamespace(ready=False,solves=0,nit=0,cold_solves=0,cold_nit=0)
+
+        # k. cache of solve_and_regress results
+        self.cache = SolutionCache(par.cache_size)
+
+        # l. counters and timings, see SolverStats
+        self.stats = SolverStats()
+
     def calc_utility(self,LM,HM,LF,HF):
         """ calculate utility """
 
         par = self.par
         sol = self.sol
 
+        if par.instrument:
+            t0 = time.perf_counter()
+
         # a. consumption of market goods
         C = par.wM*LM + par.wF*LF
 
         # b. home production
+        H = self.calc_home_production(LM,HM,LF,HF)
+
+        # c. total consumption utility
+        Q = C**par.omega*H**(1-par.omega)
+        utility = np.fmax(Q,1e-8)**(1-par.rho)/(1-par.rho)
+
+        # d. disutility of work
+        disutility = self.calc_disutility(LM,HM,LF,HF)
+
+        if par.instrument:
+            self.stats.count('calc_utility',np.size(LM),time.perf_counter()-t0)
+        
+        return utility - disutility
+
+    def calc_utility_fused(self,LM,HM,LF,HF,out=None,work=None):
+        """ calculate utility as calc_utility, but in place in preallocated buffers
+
+        Parameters:
+
+        out: array
+            Buffer for the utility, of the shape of LM...HF. Its dtype is the precision used.
+        work: tuple
+            Two more buffers like out used as scratch space.
+
+        In float64 the result is identical to calc_utility.
+        """
+
+        par = self.par
+
+        if par.instrument:
+            t0 = time.perf_counter()
+
+        if out is None:
+            out = np.empty(np.shape(LM),dtype=np.result_type(LM,float))
+        if work is None:
+            work = (np.empty_like(out),np.empty_like(out))
+        a,b = work
+
+        # a. consumption of market goods, C**omega in a
+        np.multiply(par.wM,LM,out=a)
+        np.multiply(par.wF,LF,out=b)
+        np.add(a,b,out=a)
+        np.power(a,par.omega,out=a)
+
+        # b. home production, H**(1-omega) in b
         if par.sigma == 0:
-            H = np.fmin(LM,HM)
+            np.fmin(LM,HM,out=b)
         
         elif par.sigma == 1:
+            np.power(HM,1-par.alpha,out=b)
+            np.power(HF,par.alpha,out=out)
+            np.multiply(b,out,out=b)
+        
+        else:
+            np.power(HM,(par.sigma-1)/par.sigma,out=b)
+            np.multiply(1-par.alpha,b,out=b)
+            np.power(HF,(par.sigma-1)/par.sigma,out=out)
+            np.multiply(par.alpha,out,out=out)
+            np.add(b,out,out=b)
+            np.power(b,par.sigma/(par.sigma-1),out=b)
+
+        np.power(b,1-par.omega,out=b)
+
+        # c. total consumption utility in a
+        np.multiply(a,b,out=a)
+        np.fmax(a,1e-8,out=a)
+        np.power(a,1-par.rho,out=a)
+        np.divide(a,1-par.rho,out=a)
+
+        # d. disutility of work in b
+        epsilon_ = 1+1/par.epsilon
+        np.add(LM,HM,out=b)
+        np.power(b,epsilon_,out=b)
+        np.divide(b,epsilon_,out=b)
+        np.multiply(par.nuM,b,out=b)
+        np.add(LF,HF,out=out)
+        np.power(out,epsilon_,out=out)
+        np.divide(out,epsilon_,out=out)
+        np.multiply(par.nuF,out,out=out)
+        np.add(b,out,out=b)
+        np.subtract(a,b,out=out)
+
+        if par.instrument:
+            self.stats.count('calc_utility_fused',np.size(LM),time.perf_counter()-t0)
+
+        return out
+
+    def _fused_argmax(self,u,LM,HM,LF,HF):
+        """ index of the first maximum of u from calc_utility_fused as in float64, and the maximum
+
+        In float32 every choice within the float32 rounding error of the maximum is evaluated
+        again with calc_utility.
+        """
+
+        if u.dtype == np.float64:
+            j = np.argmax(u)
+            return j,u[j]
+
+        u_max = np.max(u)
+        candidates = np.flatnonzero(u >= u_max - 1e-4*max(1,abs(u_max)))
+        x = [np.asarray(v[candidates],dtype=float) for v in (LM,HM,LF,HF)]
+        u = self.calc_utility(*x)
+        j = np.argmax(u)
+
+        return candidates[j],u[j]
+
+    def calc_home_production(self,LM,HM,LF,HF):
+        """ calculate home production (does not depend on wages) """
+
+        par = self.par
+
+        # (np.all: par may hold one sigma per household, see solve_population)
+        if np.all(par.sigma == 0):
+            H = np.fmin(LM,HM)
+        
+        elif np.all(par.sigma == 1):
             H = HM**(1-par.alpha) * HF**par.alpha
         
         else:
             H = ((1-par.alpha)*HM**((par.sigma-1)/par.sigma) + par.alpha*HF**((par.sigma-1)/par.sigma)) ** (par.sigma/(par.sigma-1))
 
-        # c. total consumption utility
-        Q = C**par.omega*H**(1-par.omega)
-        utility = np.fmax(Q,1e-8)**(1-par.rho)/(1-par.rho)
+        return H
+
+    def calc_disutility(self,LM,HM,LF,HF):
+        """ calculate disutility of work (does not depend on wages) """
+
+        par = self.par
 
-        # d. disutility of work
         epsilon_ = 1+1/par.epsilon
         TM = LM+HM
         TF = LF+HF
-        disutility = par.nuM*(TM**epsilon_/epsilon_) + par.nuF*(TF**epsilon_/epsilon_)
         
-        return utility - disutility
+        return par.nuM*(TM**epsilon_/epsilon_) + par.nuF*(TF**epsilon_/epsilon_)
+
+    def calc_utility_grad(self,LM,HM,LF,HF):
+        """ calculate the gradient of utility with respect to (LM,HM,LF,HF) """
+
+        par = self.par
+
+        if par.instrument:
+            t0 = time.perf_counter()
+
+        # a. consumption of market goods
+        C = par.wM*LM + par.wF*LF
+
+        # b. home production and its derivatives (kept finite at zero hours)
+        HM_ = np.fmax(HM,1e-8)
+        HF_ = np.fmax(HF,1e-8)
+
+        with np.errstate(divide='ignore',invalid='ignore'):
+
+            if np.all(par.sigma == 0):
+                H = np.fmin(LM,HM)
+                dH_dLM = np.where(LM < HM,1.0,0.0)
+                dH_dHM = 1.0 - dH_dLM
+                dH_dHF = 0.0
+            
+            elif np.all(par.sigma == 1):
+                H = HM**(1-par.alpha) * HF**par.alpha
+                dH_dLM = 0.0
+                dH_dHM = (1-par.alpha) * HM_**(-par.alpha) * HF**par.alpha
+                dH_dHF = par.alpha * HM**(1-par.alpha) * HF_**(par.alpha-1)
+            
+            else:
+                r = (par.sigma-1)/par.sigma
+                inner = (1-par.alpha)*HM**r + par.alpha*HF**r
+                H = inner**(1/r)
+                dH_dLM = 0.0
+                dH_dHM = inner**(1/r-1) * (1-par.alpha)*HM_**(r-1)
+                dH_dHF = inner**(1/r-1) * par.alpha*HF_**(r-1)
+
+            # c. total consumption utility, flat below the floor on Q
+            Q = C**par.omega*H**(1-par.omega)
+            I = Q > 1e-8
+            dU_dQ = np.where(I,np.fmax(Q,1e-8)**(-par.rho),0.0)
+            dQ_dC = np.where(I,par.omega*Q/C,0.0)
+            dQ_dH = np.where(I,(1-par.omega)*Q/H,0.0)
+
+        # d. marginal disutility of work
+        TM = LM+HM
+        TF = LF+HF
+        dD_dTM = par.nuM*TM**(1/par.epsilon)
+        dD_dTF = par.nuF*TF**(1/par.epsilon)
+
+        # e. chain rule
+        dU_dLM = dU_dQ*(dQ_dC*par.wM + dQ_dH*dH_dLM) - dD_dTM
+        dU_dHM = dU_dQ*dQ_dH*dH_dHM - dD_dTM
+        dU_dLF = dU_dQ*dQ_dC*par.wF - dD_dTF
+        dU_dHF = dU_dQ*dQ_dH*dH_dHF - dD_dTF
+
+        if par.instrument:
+            self.stats.count('calc_utility_grad',np.size(LM),time.perf_counter()-t0)
+
+        return np.array([dU_dLM,dU_dHM,dU_dLF,dU_dHF])
 
     def solve_discrete(self,do_print=False):
-        """ solve model discretely """
+        """ solve model discretely
+
+        With par.fused, the grid is walked block by block in preallocated buffers
+        (see solve_discrete_chunked), which gives the same optimum.
+        """
         
+        if self.par.fused:
+            return self.solve_discrete_chunked(do_print)
+
         opt = SimpleNamespace()
         
         # a. all possible choices
-        x = np.linspace(0,24,49)
+        x = np.linspace(0,24,self.par.n_grid)
         LM,HM,LF,HF = np.meshgrid(x,x,x,x) # all combinations
     
         LM = LM.ravel() # vector
@@ -113,6 +332,157 @@ class HouseholdSpecializationModelClass:
 
         return opt
 
+    def solve_discrete_chunked(self,do_print=False):
+        """ solve model discretely on the same grid as solve_discrete, but block by block
+
+        Only feasible choices (LM+HM <= 24 and LF+HF <= 24) are visited and at most 
+        par.chunk_size of them are held in memory at a time, so peak memory does not 
+        depend on par.n_grid. The grid is walked in the same order as the meshgrid in 
+        solve_discrete and ties keep the first maximum, so the optimum is identical.
+        """
+
+        par = self.par
+        opt = SimpleNamespace()
+
+        # a. feasible choices
+        grid = self._feasible_grid()
+        if par.fused: # and buffers reused by every block
+            blocks = self._grid_blocks(tuple(v.astype(par.fused_dtype) for v in grid))
+            buffers = np.empty((3,par.chunk_size),dtype=par.fused_dtype)
+        else:
+            blocks = self._grid_blocks(grid)
+
+        # b. running argmax over blocks of the flattened choice space
+        u_best = -np.inf
+        j_best = 0
+        for k,LM,HM,LF,HF in blocks:
+            
+            # i. utility
+            if par.fused:
+                out,a,b = buffers[:,:k.size]
+                u = self.calc_utility_fused(LM,HM,LF,HF,out,(a,b))
+                j,u_j = self._fused_argmax(u,LM,HM,LF,HF)
+            else:
+                u = self.calc_utility(LM,HM,LF,HF)
+                j = np.argmax(u)
+                u_j = u[j]
+
+            # ii. keep first maximum
+            if u_j > u_best:
+                u_best = u_j
+                j_best = k[j]
+
+        # c. maximizing argument
+        opt.LM,opt.HM,opt.LF,opt.HF = self._grid_choice(grid,j_best)
+        opt.u = self.calc_utility(opt.LM, opt.HM, opt.LF, opt.HF)
+
+        # d. print
+        if do_print:
+            for k,v in opt.__dict__.items():
+                print(f'{k} = {v:6.4f}')
+
+        return opt
+
+    def solve_discrete_adaptive(self,do_print=False):
+        """ solve model discretely on grids zooming in on the optimum
+
+        The first level is a grid of par.adaptive_n points per hour choice on [0,24]. Each 
+        following level puts par.adaptive_n points per hour choice in a box of plus/minus 
+        par.adaptive_zoom grid steps around the best choice so far, so the grid step shrinks by 
+        a factor (par.adaptive_n-1)/(2*par.adaptive_zoom) per level. Utility is concave (for sigma > 0), 
+        so a coarse first level finds the region of the global optimum. A box narrower than the
+        grid step can miss the optimum, but it then moves towards it in the next levels, which 
+        catch up as long as par.adaptive_zoom >= (par.adaptive_n-1)/(par.adaptive_n+1).
+        """
+
+        par = self.par
+        opt = SimpleNamespace()
+
+        # a. first level
+        x = np.linspace(0,24,par.adaptive_n)
+        axes = [x,x,x,x]
+        step = 24/(par.adaptive_n-1)
+        u_best = -np.inf
+        best = None
+
+        for level in range(par.adaptive_depth):
+            
+            # i. feasible choices on this level
+            grid = self._feasible_grid(axes)
+
+            # ii. best choice on this level (the previous best is on the grid, too)
+            for k,LM,HM,LF,HF in self._grid_blocks(grid):
+                u = self.calc_utility(LM,HM,LF,HF)
+                j = np.argmax(u)
+                if u[j] > u_best:
+                    u_best = u[j]
+                    best = self._grid_choice(grid,k[j])
+
+            # iii. zoom in
+            half = par.adaptive_zoom*step
+            axes = [np.unique(np.clip(np.linspace(v-half,v+half,par.adaptive_n),0,24)) for v in best]
+            step = 2*half/(par.adaptive_n-1)
+
+        # b. maximizing argument
+        opt.LM,opt.HM,opt.LF,opt.HF = best
+        opt.u = self.calc_utility(opt.LM, opt.HM, opt.LF, opt.HF)
+
+        # c. print
+        if do_print:
+            for k,v in opt.__dict__.items():
+                print(f'{k} = {v:6.4f}')
+
+        return opt
+
+    def _feasible_grid(self,axes=None):
+        """ feasible choices for each member, (HM,LM) and (LF,HF) in the meshgrid order of solve_discrete
+
+        axes are the grid values of (LM,HM,LF,HF), defaulting to par.n_grid points on [0,24] for all.
+        """
+
+        if axes is None:
+            x = np.linspace(0,24,self.par.n_grid)
+            axes = [x,x,x,x]
+        
+        x_LM,x_HM,x_LF,x_HF = axes
+        HM,LM = self._feasible_pairs(x_HM,x_LM)
+        LF,HF = self._feasible_pairs(x_LF,x_HF)
+
+        return LM,HM,LF,HF
+
+    @staticmethod
+    def _feasible_pairs(x_a,x_b):
+        """ all combinations (a,b) with a+b <= 24, a varying slowest """
+
+        a,b = np.meshgrid(x_a,x_b,indexing='ij')
+        a = a.ravel()
+        b = b.ravel()
+        I = a+b <= 24
+
+        return a[I],b[I]
+
+    def _grid_blocks(self,grid):
+        """ yield (k,LM,HM,LF,HF) for blocks of at most par.chunk_size choices, k is the flat index """
+
+        LM_out,HM_out,LF_in,HF_in = grid
+        n_in = LF_in.size
+        n = HM_out.size*n_in
+
+        for start in range(0,n,self.par.chunk_size):
+            k = np.arange(start,min(start+self.par.chunk_size,n))
+            k_out = k // n_in
+            k_in = k - k_out*n_in
+            yield k,LM_out[k_out],HM_out[k_out],LF_in[k_in],HF_in[k_in]
+
+    @staticmethod
+    def _grid_choice(grid,j):
+        """ (LM,HM,LF,HF) at flat index j """
+
+        LM_out,HM_out,LF_in,HF_in = grid
+        j_out,j_in = divmod(j,LF_in.size)
+
+        return LM_out[j_out],HM_out[j_out],LF_in[j_in],HF_in[j_in]
+
     def solve(self,do_print=False):
         """ solve model continously """
         
@@ -122,34 +492,106 @@ class HouseholdSpecializationModelClass:
         def objective_function(x):
             return -self.calc_utility(x[0], x[1], x[2], x[3]) * 100 # we made a positive monotone transformation so that the optimization works best
         
+        def objective_jacobian(x):
+            return -self.calc_utility_grad(x[0], x[1], x[2], x[3]) * 100
+
         # b. constraints
         cons1 = lambda x: 24 - x[0] - x[1]    #time spent by male can't be above 24
         cons2 = lambda x: 24 - x[2] - x[3]    #time spent by female can't be above 24
-        constraints = ({'type': 'ineq', 'fun': cons1},
-                       {'type': 'ineq', 'fun': cons2})
+        constraints = ({'type': 'ineq', 'fun': cons1, 'jac': lambda x: np.array([-1.0,-1.0,0.0,0.0])},
+                       {'type': 'ineq', 'fun': cons2, 'jac': lambda x: np.array([0.0,0.0,-1.0,-1.0])})
         bounds = ((0,24), (0,24), (0,24), (0,24))
         
 
         # c. call solver
-        initial_guess = [12, 12, 12, 12]
-        sol = optimize.minimize(objective_function,initial_guess,
-                                method='SLSQP',bounds=bounds,constraints=constraints)
+        # (warm starts use a tighter tolerance, so that the solution depends little on the seed)
+        ftol = self.par.warm_ftol if self.par.warm_start else 1e-6
+        warm = self.sol.x0 is not None
+        if warm: # pulled slightly towards the interior so that corners are not sticky
+            initial_guess = 0.9*np.nan_to_num(self.sol.x0) + 0.1*6
+        else:
+            initial_guess = [12, 12, 12, 12]
+        if self.par.instrument:
+            t0 = time.perf_counter()
+        sol = optimize.minimize(objective_function,initial_guess,jac=objective_jacobian,
+                                method='SLSQP',bounds=bounds,constraints=constraints,options={'ftol':ftol})
         
-        # d. save
+        # d. count iterations
+        if warm:
+            self.sol.warm.solves += 1
+            self.sol.warm.nit += sol.nit
+        else:
+            self.sol.warm.cold_solves += 1
+            self.sol.warm.cold_nit += sol.nit
+
+        if self.par.instrument:
+            self.stats.count_slsqp(self.par.wF,sol.nit,sol.success,time.perf_counter()-t0)
+
+        # e. save
         opt.LM = sol.x[0]
         opt.HM = sol.x[1]
         opt.LF = sol.x[2]
         opt.HF = sol.x[3]
         opt.u = self.calc_utility(opt.LM,opt.HM,opt.LF,opt.HF) / 100
         
-        # e. print
+        # f. print
         if do_print:
             for k,v in opt.__dict__.items():
                 print(f'{k} = {v:6.4f}')
 
         return opt   
 
-    def solve_wF_vec(self,method,plot=False):
+    def solve_reduced(self,do_print=False):
+        """ solve model continously using the first-order conditions to reduce it to one dimension
+
+        With interior hours the first-order conditions give
+            HF/HM = (alpha/(1-alpha) * wM/wF)**sigma
+            TF/TM = (nuM/nuF * wF/wM)**epsilon
+        and, since Q is Cobb-Douglas in C and H, spending a share 1-omega of full income
+        on home production pins down HM given TM. Only TM is then left to be found. 
+        If the optimum is at a corner (some hours are zero or a member works 24 hours) or
+        sigma = 0, the 4-dimensional solve() is used instead.
+        """
+
+        par = self.par
+        opt = SimpleNamespace()
+
+        # a. fall back when the first-order conditions are not available
+        if par.sigma == 0 or par.alpha in (0,1) or par.nuM <= 0 or par.nuF <= 0:
+            return self.solve(do_print=do_print)
+
+        # b. ratios implied by the first-order conditions
+        k = (par.alpha/(1-par.alpha)*par.wM/par.wF)**par.sigma   # HF/HM
+        m = (par.nuM/par.nuF*par.wF/par.wM)**par.epsilon        # TF/TM
+        h = (1-par.omega)*(par.wM + par.wF*m)/(par.wM + par.wF*k) # HM/TM
+
+        # c. fall back if some market work would be negative at any TM
+        if h > 1 or k*h > m:
+            return self.solve(do_print=do_print)
+
+        hours = lambda TM: (TM*(1-h), TM*h, TM*(m-k*h), TM*k*h) # (LM,HM,LF,HF)
+
+        # d. find TM
+        TM_max = min(24,24/m)
+        result = optimize.minimize_scalar(lambda TM: -self.calc_utility(*hours(TM)),
+                                          bounds=(0,TM_max),method='bounded',options={'xatol':1e-8})
+
+        # e. fall back at the 24 hour corner
+        if not result.success or result.x > TM_max - 1e-6:
+            return self.solve(do_print=do_print)
+
+        # f. save
+        opt.LM,opt.HM,opt.LF,opt.HF = hours(result.x)
+        opt.u = self.calc_utility(opt.LM,opt.HM,opt.LF,opt.HF) / 100 # as in solve
+        
+        # g. print
+        if do_print:
+            for k,v in opt.__dict__.items():
+                print(f'{k} = {v:6.4f}')
+
+        return opt
+
+    def solve_wF_vec(self,method,plot=False,executor=None):
         """
         Solve model for vector of female wages 
         
@@ -157,27 +599,31 @@ class HouseholdSpecializationModelClass:
         
         method: func
             It is the method that will be applied to solve the problem.
-            It should be "model.solve_discrete" or a "model.solve".
+            It should be "model.solve_discrete", "model.solve_discrete_chunked", "model.solve_discrete_adaptive", "model.solve" or "model.solve_reduced".
         plot: Bool
             If True, then it will create a plot with the ratios of household production and wages.
+        executor: concurrent.futures.Executor
+            If given, the wages are solved in parallel on it. Else, if par.n_workers > 1, a process pool is used.
         """
         
         par = self.par
         sol = self.sol
-        opt = SimpleNamespace()
+        self._allocate_wF_vec()
 
-        # a. solve for all wF values
-        for i, wF in enumerate(par.wF_vec):
-            par.wF = wF
-            
-            opt = method()
-            sol.LM_vec[i] = opt.LM
-            sol.HM_vec[i] = opt.HM
-            sol.LF_vec[i] = opt.LF
-            sol.HF_vec[i] = opt.HF
+        # a. seeds: last solution at each wage (else solve_wages continues from the previous wage)
+        if par.warm_start and sol.warm.ready:
+            x0_vec = np.array([sol.LM_vec,sol.HM_vec,sol.LF_vec,sol.HF_vec]).T
+        else:
+            x0_vec = None
+
+        # b. solve for all wF values
+        if executor is None and par.n_workers > 1:
+            with ProcessPoolExecutor(par.n_workers) as executor:
+                res = solve_wages(freeze(par),method.__name__,x0_vec,executor)
+        else:
+            res = solve_wages(freeze(par),method.__name__,x0_vec,executor)
 
-        # b. parameter reset
-        par.wF = 1
+        self._store_wF_vec(res)
 
         # c. plot
         if plot:
@@ -193,90 +639,1280 @@ class HouseholdSpecializationModelClass:
             plt.title("log HF/HM against log wF/wM")
             plt.show()   
 
+    def solve_discrete_wF_vec(self):
+        """
+        Solve model discretely for all of par.wF_vec in one pass over the grid
+        
+        Home production, the disutility of work and wM*LM do not depend on wF, so they
+        are computed once per block of the grid and shared by all wages; only consumption
+        and the utility of it are evaluated per wage. Gives the same result as 
+        solve_wF_vec(solve_discrete).
+        """
+
+        par = self.par
+        sol = self.sol
+        self._allocate_wF_vec()
+
+        # a. feasible choices
+        grid = self._feasible_grid()
+
+        # b. running argmax for every wage
+        u_best = np.full(par.wF_vec.size,-np.inf)
+        j_best = np.zeros(par.wF_vec.size,dtype=int)
+        for k,LM,HM,LF,HF in self._grid_blocks(grid):
+
+            # i. wage independent parts
+            CM = par.wM*LM
+            H_ = self.calc_home_production(LM,HM,LF,HF)**(1-par.omega)
+            disutility = self.calc_disutility(LM,HM,LF,HF)
+
+            # ii. utility and first maximum for each wage
+            for i,wF in enumerate(par.wF_vec):
+                C = CM + wF*LF
+                Q = C**par.omega*H_
+                u = np.fmax(Q,1e-8)**(1-par.rho)/(1-par.rho) - disutility
+
+                j = np.argmax(u)
+                if u[j] > u_best[i]:
+                    u_best[i] = u[j]
+                    j_best[i] = k[j]
+
+        # c. store
+        for i in range(par.wF_vec.size):
+            sol.LM_vec[i],sol.HM_vec[i],sol.LF_vec[i],sol.HF_vec[i] = self._grid_choice(grid,j_best[i])
+
+        return sol
+
+    def warm_start_savings(self,run=None):
+        """
+        Report the SLSQP iterations saved by warm starting (par.warm_start)
+
+        Parameters:
+
+        run: func
+            If given, run(model) (e.g. lambda model: model.estimate()) is done on two copies of the model, 
+            with and without warm starting and with the cache disabled. The saving is then measured as the 
+            difference in total iterations and seconds, which includes any extra evaluations of the estimator. 
+            Else, the counts of this model are reported, and the saving is only estimated from the average 
+            number of iterations of the cold starts from [12,12,12,12] made by the same model.
+        """
+
+        # a. counts of this model
+        if run is None:
+            warm = self.sol.warm
+            report = SimpleNamespace()
+
+            report.warm_solves = warm.solves
+            report.warm_nit = warm.nit
+            report.cold_solves = warm.cold_solves
+            report.cold_nit = warm.cold_nit
+            report.total_solves = warm.solves + warm.cold_solves
+            report.total_nit = warm.nit + warm.cold_nit
+
+            if warm.cold_solves > 0:
+                report.saved_nit = warm.solves*warm.cold_nit/warm.cold_solves - warm.nit
+            else:
+                report.saved_nit = np.nan
+
+            return report
+
+        # b. measured against a cold run
+        runs = {}
+        for warm_start in (True,False):
+            
+            # i. fresh copy
+            model = HouseholdSpecializationModelClass()
+            model.par = SimpleNamespace(**self.par.__dict__)
+            model.par.warm_start = warm_start
+            model.par.cache_size = 0
+            model.cache.maxsize = 0
+
+            # ii. run
+            t0 = time.perf_counter()
+            run(model)
+            seconds = time.perf_counter() - t0
+
+            runs[warm_start] = model.warm_start_savings()
+            runs[warm_start].seconds = seconds
+
+        report = SimpleNamespace()
+        report.warm_solves = runs[True].total_solves
+        report.warm_nit = runs[True].total_nit
+        report.warm_seconds = runs[True].seconds
+        report.cold_solves = runs[False].total_solves
+        report.cold_nit = runs[False].total_nit
+        report.cold_seconds = runs[False].seconds
+        report.saved_nit = report.cold_nit - report.warm_nit
+        report.saved_seconds = report.cold_seconds - report.warm_seconds
+
+        return report
+
+    def _allocate_wF_vec(self):
+        """ resize the solution vectors if par.wF_vec has changed size """
+
+        par = self.par
+        sol = self.sol
+
+        if sol.LM_vec.size != par.wF_vec.size:
+            sol.warm.ready = False
+            sol.LM_vec = np.zeros(par.wF_vec.size)
+            sol.HM_vec = np.zeros(par.wF_vec.size)
+            sol.LF_vec = np.zeros(par.wF_vec.size)
+            sol.HF_vec = np.zeros(par.wF_vec.size)
+
+    def _store_wF_vec(self,res):
+        """ copy a result of solve_wages (or solve_and_regress) into sol """
+
+        sol = self.sol
+
+        sol.LM_vec[:] = res.LM_vec
+        sol.HM_vec[:] = res.HM_vec
+        sol.LF_vec[:] = res.LF_vec
+        sol.HF_vec[:] = res.HF_vec
+
+        _add_counts(sol.warm,res.warm)
+        sol.warm.ready = True
+
+        if self.par.instrument:
+            self.stats.add(res.stats)
+
     def run_regression(self):
         """ run regression """
 
         par = self.par
         sol = self.sol
     
-        x = np.log10(par.wF_vec/par.wM)
-        y = np.log10(sol.HF_vec/sol.HM_vec)
-        A = np.vstack([np.ones(x.size),x]).T
-        sol.beta0,sol.beta1 = np.linalg.lstsq(A,y,rcond=None)[0]
+        if par.instrument:
+            t0 = time.perf_counter()
+
+        sol.beta0,sol.beta1 = regress(par,sol.HF_vec,sol.HM_vec)
+
+        if par.instrument:
+            self.stats.count('regress',seconds=time.perf_counter()-t0)
         
         return sol
 
-    def estimate(self,alpha=None):
+    def calc_beta_jacobian(self,names=('alpha','sigma')):
+        """
+        Derivatives of (beta0,beta1) with respect to the parameters in names at the current solution
+
+        Uses the solutions in sol.LM_vec...sol.HF_vec, e.g. from solve_wF_vec. See beta_jacobian.
+        The (2,len(names)) array is also stored in sol.beta_jac.
+        """
+
+        sol = self.sol
+        
+        sol.beta_jac = beta_jacobian(self.par,sol,names)
+
+        return sol.beta_jac
+
+    def solve_and_regress(self,method,executor=None):
+        """
+        Solve model for vector of female wages and run the regression, using the cache
+        
+        A cache hit restores sol.LM_vec...sol.HF_vec, sol.beta0 and sol.beta1 without solving.
+        """
+
+        par = self.par
+        sol = self.sol
+        self._allocate_wF_vec()
+
+        # a. seeds
+        if par.warm_start and sol.warm.ready:
+            x0_vec = np.array([sol.LM_vec,sol.HM_vec,sol.LF_vec,sol.HF_vec]).T
+        else:
+            x0_vec = None
+
+        # b. solve
+        self.cache.maxsize = par.cache_size
+        res = solve_and_regress(freeze(par),method.__name__,x0_vec,executor,self.cache)
+
+        # c. store
+        self._store_wF_vec(res)
+        sol.beta0,sol.beta1 = res.beta0,res.beta1
+
+        return sol
+
+    def _estimation_executor(self):
+        """ process pool for the solves in estimate (None when used in a with-statement, if par.n_workers is 1) """
+
+        return ProcessPoolExecutor(self.par.n_workers) if self.par.n_workers > 1 else _no_executor()
+
+    def estimate(self,alpha=None,method=None,optimizer='Nelder-Mead'):
+        """
+        Estimate alpha and sigma by matching beta0_target and beta1_target
+
+        Parameters:
+
+        alpha: float
+            If given, alpha is fixed at this value and only sigma is estimated.
+        method: func
+            Solver used for every wage, defaults to "model.solve". "model.solve_reduced" is much faster.
+        optimizer: str
+            "Nelder-Mead", or "Gauss-Newton" for a bounded least squares fit using the 
+            derivatives of the betas from beta_jacobian. It needs far fewer solves.
+        """
+
         par = self.par
         opt = SimpleNamespace()
+        method = self.solve if method is None else method
+        self.cache.maxsize = par.cache_size
 
         # a. objective function (to minimize) 
-        def error(x):
-            if alpha == None:
-                par.alpha = x[0]
-            else:
-                par.alpha = alpha
-            par.sigma = x[1]
-            self.solve_wF_vec(self.solve)
-            sol = self.run_regression()
-            error = (par.beta0_target - sol.beta0)**2 + (par.beta1_target - sol.beta1)**2
-            return error * 100
+        names = ('alpha','sigma')
+        fixed = {} if alpha == None else {'alpha':alpha}
         
         # b. constraints
         bounds = ((0,1), (0,5))
         
         # c. call solver
         initial_guess = [0.5, 1]
-        result = optimize.minimize(error,initial_guess, method='Nelder-Mead',bounds=bounds)
+        stats = self.stats if par.instrument else None
+        t0 = time.perf_counter()
+        with self._estimation_executor() as executor:
+            if optimizer == 'Gauss-Newton':
+                k = 0 if alpha == None else 1 # a fixed alpha is not a free parameter here
+                x = _estimate_gauss_newton(par,method.__name__,executor,self.cache,self.sol.warm,
+                                           names[k:],initial_guess[k:],bounds[k:],stats=stats,**fixed)
+                x = np.concatenate([initial_guess[:k],x])
+            else:
+                error = _estimation_error(par,method.__name__,executor,self.cache,self.sol.warm,stats=stats,**fixed)
+                x = optimize.minimize(error,initial_guess,args=(names,),method='Nelder-Mead',bounds=bounds).x
+        
+        if par.instrument:
+            self.stats.count('estimate',seconds=time.perf_counter()-t0)
         
         # d. save
         if alpha == None:
-            opt.alpha = result.x[0]
+            opt.alpha = x[0]
         else:
             opt.alpha = alpha
         
-        opt.sigma = result.x[1]
+        opt.sigma = x[1]
 
         par.alpha = opt.alpha
         par.sigma = opt.sigma
+        self.solve_and_regress(method)
 
         return
     
-    def estimate_nu(self):
+    def estimate_nu(self,method=None,optimizer='Nelder-Mead'):
+        """
+        Estimate sigma, nuM and nuF by matching beta0_target and beta1_target
+
+        Parameters:
+
+        method: func
+            Solver used for every wage, defaults to "model.solve". "model.solve_reduced" is much faster.
+        optimizer: str
+            "Nelder-Mead" or "Gauss-Newton", see estimate.
+        """
+
         par = self.par
         opt = SimpleNamespace()
+        method = self.solve if method is None else method
+        self.cache.maxsize = par.cache_size
 
         # a. objective function (to minimize) 
-        def error(x):
-            par.sigma = x[0]
-            par.nuM = x[1]
-            par.nuF = x[2]
-            self.solve_wF_vec(self.solve)
-            sol = self.run_regression()
-            
-            error = (par.beta0_target - sol.beta0)**2 + (par.beta1_target - sol.beta1)**2
-            return error * 100
+        names = ('sigma','nuM','nuF')
         
         # b. constraints
         bounds = ((0,5), (0,1), (0,1))
         
         # c. call solver
         initial_guess = [1.0, 0.01, 0.01]
-        result = optimize.minimize(error,initial_guess, method='Nelder-Mead',bounds=bounds)
+        stats = self.stats if par.instrument else None
+        t0 = time.perf_counter()
+        with self._estimation_executor() as executor:
+            if optimizer == 'Gauss-Newton':
+                x = _estimate_gauss_newton(par,method.__name__,executor,self.cache,self.sol.warm,
+                                           names,initial_guess,bounds,stats=stats)
+            else:
+                error = _estimation_error(par,method.__name__,executor,self.cache,self.sol.warm,stats=stats)
+                x = optimize.minimize(error,initial_guess,args=(names,),method='Nelder-Mead',bounds=bounds).x
+        
+        if par.instrument:
+            self.stats.count('estimate_nu',seconds=time.perf_counter()-t0)
         
-        opt.sigma = result.x[0]
-        opt.nuM = result.x[1]
-        opt.nuF = result.x[2]
+        opt.sigma = x[0]
+        opt.nuM = x[1]
+        opt.nuF = x[2]
 
         par.sigma = opt.sigma
         par.nuM = opt.nuM
         par.nuF = opt.nuF
+        self.solve_and_regress(method)
 
         return opt.sigma, opt.nuM, opt.nuF
 
+    def estimate_multistart(self,names=('alpha','sigma'),n_starts=8,sampler=None,target_loss=None,method=None,n_workers=None,seed=None):
+        """
+        Estimate the parameters in names from several starting points in parallel
+
+        Parameters:
+
+        names: tuple
+            Parameters to estimate, from ESTIMATION_BOUNDS. The others are kept at their values in par.
+        n_starts: int
+            Number of Nelder-Mead runs.
+        sampler: func
+            sampler(rng,n_starts) returns an (n_starts,len(names)) array of starting points. 
+            Defaults to the usual starting point followed by uniform draws within the bounds.
+        target_loss: float
+            If given, the remaining starts are stopped once a start reaches this loss.
+        method: func
+            Solver used for every wage, defaults to "model.solve".
+        n_workers: int
+            Number of processes, defaults to par.n_workers. With 1 the starts run one after another.
+        seed: int
+            Seed of the generator passed to sampler.
+
+        Returns opt with the best estimates and loss, and a DataFrame with one row per start.
+        The best estimates are also set in par.
+        """
+
+        par = self.par
+        method = self.solve if method is None else method
+        n_workers = par.n_workers if n_workers is None else n_workers
+
+        # a. starting points
+        bounds = tuple(ESTIMATION_BOUNDS[name] for name in names)
+        if sampler is None:
+            sampler = lambda rng,n: _sample_starts(rng,n,names,bounds)
+        x0s = np.asarray(sampler(np.random.default_rng(seed),n_starts),dtype=float)
+
+        # b. run starts
+        fits = [None]*n_starts
+        frozen = freeze(par)
+
+        if n_workers == 1:
+            for i,x0 in enumerate(x0s):
+                fits[i] = estimate_household(frozen,names,x0,bounds,method.__name__,target_loss)
+                if target_loss is not None and fits[i].loss <= target_loss:
+                    break
+        
+        else:
+            with Manager() as manager, ProcessPoolExecutor(n_workers) as executor:
+                stop = manager.Event()
+                futures = {executor.submit(estimate_household,frozen,names,x0,bounds,method.__name__,target_loss,stop):i for i,x0 in enumerate(x0s)}
+                
+                for future in as_completed(futures):
+                    if future.cancelled(): # never started, see the table
+                        continue
+                    fits[futures[future]] = future.result()
+                    if target_loss is not None and fits[futures[future]].loss <= target_loss:
+                        stop.set()
+                        for other in futures:
+                            other.cancel()
+
+        # c. table of starts
+        rows = []
+        for i,(x0,fit) in enumerate(zip(x0s,fits)):
+            row = {'start':i}
+            row.update({f'{name}0':v for name,v in zip(names,x0)})
+            if fit is None: # never started
+                row.update({name:np.nan for name in names})
+                row.update(loss=np.nan,nfev=0,stopped=True)
+            else:
+                row.update({name:v for name,v in zip(names,fit.x)})
+                row.update(loss=fit.loss,nfev=fit.nfev,stopped=fit.stopped)
+            rows.append(row)
+        table = pd.DataFrame(rows).set_index('start')
+
+        # d. best fit
+        opt = SimpleNamespace()
+        best = table['loss'].idxmin()
+        for name in names:
+            opt.__dict__[name] = table.loc[best,name]
+            setattr(par,name,opt.__dict__[name])
+        opt.loss = table.loc[best,'loss']
+
+        self.solve_and_regress(method)
+
+        return opt,table
+
+    def solve_population(self,**columns):
+        """
+        Solve model for many heterogeneous households at once, see solve_population
+
+        Parameters:
+
+        columns: arrays
+            One value per household for any of the parameters, e.g. wF=..., nuM=..., alpha=..., sigma=...
+            Parameters not given are taken from par.
+        """
+
+        return solve_population(freeze(self.par),**columns)
+
+    def tabulate(self,axes,method=None,filename=None,executor=None):
+        """
+        Tabulate (beta0,beta1) on a grid of parameters, see tabulate_betas
+
+        Parameters:
+
+        axes: dict
+            Grid values for each parameter, e.g. {'alpha':np.linspace(0.05,0.95,19),'sigma':np.linspace(0.1,2,20)}.
+        method: func
+            Solver used for every wage, defaults to "model.solve".
+        filename: str
+            If given, the surface is saved with save_surface.
+        executor: concurrent.futures.Executor
+            If given, the grid points are solved in parallel on it. Else, if par.n_workers > 1, a process pool is used.
+        """
+
+        method = self.solve if method is None else method
+
+        if executor is None and self.par.n_workers > 1:
+            with ProcessPoolExecutor(self.par.n_workers) as executor:
+                surface = tabulate_betas(freeze(self.par),axes,method.__name__,executor)
+        else:
+            surface = tabulate_betas(freeze(self.par),axes,method.__name__,executor)
+
+        if filename is not None:
+            save_surface(surface,filename)
+
+        return surface
+
+    def estimate_surface(self,surface,refine=True,method=None):
+        """
+        Estimate the parameters of a tabulated surface by matching beta0_target and beta1_target
+        
+        The betas are interpolated (linearly) on the surface, so no model is solved to find the
+        estimates on it. With refine, a Nelder-Mead run with true solves starts from there.
+
+        Parameters:
+
+        surface: namespace
+            From tabulate or load_surface.
+        refine: bool
+            If True, the interpolated estimates are refined with true solves.
+        method: func
+            Solver used for every wage in the refinement, defaults to "model.solve".
+
+        Returns opt with the estimates and loss. The estimates are also set in par.
+        """
+
+        par = self.par
+        opt = SimpleNamespace()
+        method = self.solve if method is None else method
+        names = surface.names
+
+        # a. loss with interpolated betas
+        targets = np.array([par.beta0_target,par.beta1_target])
+        interp = RegularGridInterpolator(surface.axes,np.asarray(surface.betas),bounds_error=False,fill_value=np.nan)
+
+        def loss(betas):
+            loss = 100*np.sum((betas-targets)**2,axis=-1)
+            return np.where(np.isnan(loss),np.inf,loss)
+        
+        # b. minimize, starting at the best grid point
+        loss_grid = loss(surface.betas)
+        x0 = [axis[i] for axis,i in zip(surface.axes,np.unravel_index(np.argmin(loss_grid),loss_grid.shape))]
+        bounds = tuple((axis[0],axis[-1]) for axis in surface.axes)
+        result = optimize.minimize(lambda x: loss(interp(x)[0]),x0,method='Nelder-Mead',bounds=bounds)
+
+        x = result.x
+        opt.loss = result.fun
+        
+        # c. refine with true solves
+        if refine:
+            bounds = tuple(ESTIMATION_BOUNDS[name] for name in names)
+            fit = estimate_household(freeze(par),names,x,bounds,method.__name__)
+            x = fit.x
+            opt.loss = fit.loss
+
+        # d. save
+        for name,v in zip(names,x):
+            opt.__dict__[name] = v
+            setattr(par,name,v)
+
+        self.solve_and_regress(method)
+
+        return opt
+
+
+SOLVERS = ('solve_discrete','solve_discrete_chunked','solve_discrete_adaptive','solve','solve_reduced')
+
+class FrozenPar(SimpleNamespace):
+    """ immutable parameter record, see freeze """
+
+    def __setattr__(self,name,value):
+        raise AttributeError('FrozenPar is immutable, use freeze(par,name=value) for a changed copy')
+
+    def __delattr__(self,name):
+        raise AttributeError('FrozenPar is immutable')
+
+def freeze(par,**changes):
+    """ immutable copy of the parameter namespace par, with optional changes """
+
+    values = dict(par.__dict__,**changes)
+    for k,v in values.items():
+        if isinstance(v,np.ndarray):
+            v = v.copy()
+            v.setflags(write=False)
+            values[k] = v
+
+    return FrozenPar(**values)
+
+def solve_household(par,method='solve',x0=None):
+    """
+    Solve model for the parameters in par, without changing any state
+
+    Safe to call concurrently from threads or processes.
+
+    Parameters:
+
+    par: namespace
+        Parameters, e.g. freeze(model.par,wF=0.9). It is not changed.
+    method: str
+        Name of the solver, one of SOLVERS.
+    x0: array
+        Initial guess (LM,HM,LF,HF) for solve (and the fallback of solve_reduced).
+
+    Returns the opt namespace of the solver, with the SLSQP iteration counts in opt.warm
+    (and the SolverStats of the call in opt.stats if par.instrument).
+    """
+
+    assert method in SOLVERS, f'method must be one of {SOLVERS}'
+
+    # a. a private model for this call
+    model = HouseholdSpecializationModelClass()
+    model.par = par
+    model.sol.x0 = x0
+
+    # b. solve
+    if par.instrument:
+        t0 = time.perf_counter()
+    
+    opt = getattr(model,method)()
+    opt.warm = model.sol.warm
+
+    if par.instrument:
+        model.stats.count(method,seconds=time.perf_counter()-t0)
+        opt.stats = model.stats
+
+    return opt
+
+def solve_wages(par,method='solve',x0_vec=None,executor=None):
+    """
+    Solve model for every wage in par.wF_vec, without changing any state
+
+    Parameters:
+
+    par: namespace
+        Parameters. It is not changed.
+    method: str
+        Name of the solver, one of SOLVERS.
+    x0_vec: array
+        Initial guesses, one row (LM,HM,LF,HF) per wage. If None and par.warm_start, 
+        each wage is seeded by the solution at the previous wage (when solved serially).
+    executor: concurrent.futures.Executor
+        If given, the wages are solved in parallel on it.
+
+    Returns a namespace with LM_vec, HM_vec, LF_vec, HF_vec and the SLSQP iteration counts in warm
+    (and the SolverStats of all wages in stats if par.instrument).
+    """
+
+    n = par.wF_vec.size
+    pars = [freeze(par,wF=wF) for wF in par.wF_vec]
+
+    # a. solve
+    if executor is not None:
+        x0s = list(x0_vec) if x0_vec is not None else [None]*n
+        opts = list(executor.map(solve_household,pars,[method]*n,x0s))
+
+    else:
+        opts = []
+        for i in range(n):
+            if x0_vec is not None:
+                x0 = x0_vec[i]
+            elif par.warm_start and i > 0:
+                x0 = [opts[-1].LM,opts[-1].HM,opts[-1].LF,opts[-1].HF]
+            else:
+                x0 = None
+            opts.append(solve_household(pars[i],method,x0))
+
+    # b. collect
+    res = SimpleNamespace()
+    res.LM_vec = np.array([opt.LM for opt in opts])
+    res.HM_vec = np.array([opt.HM for opt in opts])
+    res.LF_vec = np.array([opt.LF for opt in opts])
+    res.HF_vec = np.array([opt.HF for opt in opts])
+    res.warm = SimpleNamespace(solves=0,nit=0,cold_solves=0,cold_nit=0)
+    for opt in opts:
+        _add_counts(res.warm,opt.warm)
+
+    if par.instrument:
+        res.stats = SolverStats()
+        for opt in opts:
+            res.stats.add(opt.stats)
+
+    return res
+
+def regress(par,HF_vec,HM_vec):
+    """ (beta0,beta1) of the regression of log HF/HM on log wF/wM """
+
+    x = np.log10(par.wF_vec/par.wM)
+    y = np.log10(HF_vec/HM_vec)
+    A = np.vstack([np.ones(x.size),x]).T
+    beta0,beta1 = np.linalg.lstsq(A,y,rcond=None)[0]
+
+    return beta0,beta1
+
+def solution_jacobian(par,x,names=('alpha','sigma')):
+    """
+    Derivatives of the solution x = (LM,HM,LF,HF) with respect to the parameters in names
+
+    By the implicit function theorem on the first-order conditions at x: hours at zero stay 
+    at zero, and a binding 24 hour constraint stays binding. The second derivatives of utility
+    are central differences of calc_utility_grad. Home production has a kink at sigma = 0, 
+    where nan is returned.
+
+    Returns a (4,len(names)) array.
+    """
+
+    if par.sigma == 0:
+        return np.full((4,len(names)),np.nan)
+
+    model = HouseholdSpecializationModelClass()
+    model.par = par
+    x = np.asarray(x,dtype=float)
+    grad = lambda model,x: model.calc_utility_grad(*x)
+
+    # a. free hours and binding time constraints
+    free = x > 1e-6
+    A = np.array([[1.0,1.0,0.0,0.0],[0.0,0.0,1.0,1.0]])
+    A = A[(A@x > 24-1e-6) & (A[:,free].sum(axis=1) > 0)][:,free]
+    n_free = free.sum()
+
+    # b. second derivatives with respect to the free hours
+    D = np.zeros((4,n_free))
+    for j,i in enumerate(np.flatnonzero(free)):
+        h = min(1e-5,x[i]/2)
+        e = np.zeros(4)
+        e[i] = h
+        D[:,j] = (grad(model,x+e) - grad(model,x-e))/(2*h)
+
+    # c. cross derivatives with respect to the parameters
+    G = np.zeros((4,len(names)))
+    for j,name in enumerate(names):
+        theta = getattr(par,name)
+        h = 1e-4*max(1,abs(theta))
+        if name in ESTIMATION_BOUNDS:
+            lo,hi = ESTIMATION_BOUNDS[name]
+            h = min(h,(theta-lo)/2,(hi-theta)/2)
+        
+        model.par = freeze(par,**{name:theta+h})
+        up = grad(model,x)
+        model.par = freeze(par,**{name:theta-h})
+        down = grad(model,x)
+        G[:,j] = (up-down)/(2*h)
+    model.par = par
+
+    # d. differentiate the first-order conditions: D dx - A' dlambda = -G, A dx = 0
+    n_con = A.shape[0]
+    K = np.block([[D[free],-A.T],[A,np.zeros((n_con,n_con))]])
+    rhs = np.vstack([-G[free],np.zeros((n_con,len(names)))])
+    
+    dx = np.zeros((4,len(names)))
+    dx[free] = np.linalg.lstsq(K,rhs,rcond=None)[0][:n_free]
+
+    return dx
+
+def beta_jacobian(par,res,names=('alpha','sigma')):
+    """
+    Derivatives of (beta0,beta1) of regress with respect to the parameters in names
+
+    res holds the solution for every wage in par.wF_vec (LM_vec...HF_vec, see solve_wages).
+    The derivatives of the solutions (solution_jacobian) are chained through the least squares 
+    fit, which is linear in y = log10(HF/HM).
+
+    Returns a (2,len(names)) array.
+    """
+
+    # a. derivatives of y
+    dy = np.zeros((par.wF_vec.size,len(names)))
+    for i,wF in enumerate(par.wF_vec):
+        x = (res.LM_vec[i],res.HM_vec[i],res.LF_vec[i],res.HF_vec[i])
+        dx = solution_jacobian(freeze(par,wF=wF),x,names)
+        dy[i] = (dx[3]/x[3] - dx[1]/x[1])/np.log(10)
+
+    # b. through the least squares fit
+    x = np.log10(par.wF_vec/par.wM)
+    A = np.vstack([np.ones(x.size),x]).T
+
+    return np.linalg.pinv(A)@dy
+
+def solve_and_regress(par,method='solve',x0_vec=None,executor=None,cache=None):
+    """
+    solve_wages followed by regress, looked up in and stored to cache (a SolutionCache) if given
+
+    Returns the namespace of solve_wages with beta0 and beta1 added.
+    """
+
+    # a. look up
+    key = _cache_key(par,method)
+    res = cache.get(key) if cache is not None else None
+
+    # b. solve on a miss
+    if res is None:
+        res = solve_wages(par,method,x0_vec,executor)
+        
+        if par.instrument:
+            t0 = time.perf_counter()
+        
+        res.beta0,res.beta1 = regress(par,res.HF_vec,res.HM_vec)
+
+        if par.instrument:
+            res.stats.count('regress',seconds=time.perf_counter()-t0)
+        
+        if cache is not None:
+            cache.put(key,res)
+
+    # c. a hit did no iterations
+    else:
+        res = SimpleNamespace(**res.__dict__)
+        res.warm = SimpleNamespace(solves=0,nit=0,cold_solves=0,cold_nit=0)
+        
+        if par.instrument:
+            res.stats = SolverStats()
+            res.stats.count('cache_hit')
+
+    return res
+
+# fields of par that do not change the solutions of solve_and_regress
+# (solve_wages sets wF from wF_vec)
+CACHE_IGNORED = ('wF','beta0_target','beta1_target','n_workers','cache_size','instrument')
 
+def _cache_key(par,method):
+    """ key of solve_and_regress results: method and every field of par that can change them """
+
+    fields = []
+    for name,value in sorted(par.__dict__.items()):
+        if name in CACHE_IGNORED:
+            continue
+        if isinstance(value,(np.ndarray,list)):
+            value = tuple(np.ravel(value))
+        fields.append((name,value))
+
+    return (method,tuple(fields))
+
+ESTIMATION_BOUNDS = {'alpha':(0,1),'sigma':(0,5),'nuM':(0,1),'nuF':(0,1)}
+
+def _estimation_error(par,method,executor,cache,counts,stats=None,**fixed):
+    """ 
+    objective of the estimators: returns error(x,names)
+    
+    The parameters are passed on in frozen copies of par, so par is not changed while estimating. 
+    With par.warm_start, each evaluation is seeded by the solution of the best evaluation so far. 
+    (Seeding from the previous evaluation makes the error depend on the path of Nelder-Mead, 
+    which then needs many more evaluations, e.g. in estimate_nu.)
+    The SLSQP iteration counts are added to counts, and the SolverStats to stats if given. 
+    The parameters and solve_and_regress result of the latest evaluation are kept in 
+    error.last.par and error.last.res.
+    """
+
+    last = SimpleNamespace(x0_vec=None,par=None,res=None,best=np.inf)
+
+    def error(x,names):
+        par_x = freeze(par,**{**dict(zip(names,x)),**fixed})
+        x0_vec = last.x0_vec if par.warm_start else None
+        res = solve_and_regress(par_x,method,x0_vec,executor,cache)
+        last.par,last.res = par_x,res
+        _add_counts(counts,res.warm)
+        if stats is not None:
+            stats.add(res.stats)
+        
+        error = (par.beta0_target - res.beta0)**2 + (par.beta1_target - res.beta1)**2
+        if error < last.best:
+            last.best = error
+            last.x0_vec = np.array([res.LM_vec,res.HM_vec,res.LF_vec,res.HF_vec]).T
+        return error * 100
+
+    error.last = last
+
+    return error
+
+def _estimate_gauss_newton(par,method,executor,cache,counts,names,x0,bounds,stats=None,**fixed):
+    """
+    Gauss-Newton (trust region least squares) estimate of the parameters in names, 
+    with the derivatives of the betas from beta_jacobian. Returns the estimates.
+    """
+
+    target = np.array([par.beta0_target,par.beta1_target])
+    error = _estimation_error(par,method,executor,cache,counts,stats,**fixed)
+    solved = SimpleNamespace(x=None)
+
+    def solve(x):
+        if solved.x is None or not np.array_equal(x,solved.x):
+            error(x,names)
+            solved.x = np.array(x)
+        return error.last.par,error.last.res
+
+    def residuals(x):
+        par_x,res = solve(x)
+        return np.array([res.beta0,res.beta1]) - target
+
+    def jacobian(x):
+        par_x,res = solve(x)
+        t0 = time.perf_counter()
+        jac = beta_jacobian(par_x,res,names)
+        if stats is not None:
+            stats.count('beta_jacobian',seconds=time.perf_counter()-t0)
+        return jac
+
+    lower,upper = np.array(bounds,dtype=float).T
+    result = optimize.least_squares(residuals,x0,jac=jacobian,bounds=(lower,upper),method='trf')
+
+    return result.x
+
+class _Stopped(Exception):
+    """ raised inside an objective to end a Nelder-Mead run early """
+
+def estimate_household(par,names,x0,bounds,method='solve',target_loss=None,stop=None):
+    """
+    Nelder-Mead estimate of the parameters in names, without changing any state
+
+    Parameters:
+
+    par: namespace
+        Parameters, the ones not in names are kept fixed. It is not changed.
+    names: tuple
+        Parameters to estimate.
+    x0: array
+        Starting point.
+    bounds: tuple
+        (lower,upper) for each parameter in names.
+    method: str
+        Name of the solver, one of SOLVERS.
+    target_loss: float
+        If given, the run ends as soon as the loss is at or below it.
+    stop: event
+        If given, the run ends as soon as it is set (e.g. by another start).
+
+    Returns a namespace with the best x found, its loss, the number of evaluations and whether it was stopped early.
+    """
+
+    # a. objective, keeping track of the best point
+    error = _estimation_error(par,method,None,SolutionCache(par.cache_size),
+                              SimpleNamespace(solves=0,nit=0,cold_solves=0,cold_nit=0))
+    fit = SimpleNamespace(x=np.array(x0,dtype=float),loss=np.inf,nfev=0,stopped=False)
+
+    def tracked_error(x):
+        if stop is not None and stop.is_set():
+            raise _Stopped
+
+        loss = error(x,names)
+        fit.nfev += 1
+        if loss < fit.loss:
+            fit.x = np.array(x,dtype=float)
+            fit.loss = loss
+        
+        if target_loss is not None and loss <= target_loss:
+            raise _Stopped
+
+        return loss
+
+    # b. call solver
+    try:
+        optimize.minimize(tracked_error,x0,method='Nelder-Mead',bounds=bounds)
+    except _Stopped:
+        fit.stopped = True
+
+    return fit
+
+def solve_population(par,maxiter=1000,tol=1e-8,**columns):
+    """
+    Solve model for many heterogeneous households at once, without changing any state
+
+    Households are grouped by home production branch (sigma = 1 and CES) and each group is 
+    solved with vectorized steps:
+    1. For interior optima, the first-order conditions of solve_reduced leave a search over TM,
+       done by golden section for all households together.
+    2. The other households (corners) take projected gradient steps with backtracking,
+       projecting each member's (L,H) on L,H >= 0 and L+H <= 24.
+    Home production has a kink when sigma = 0, where gradient steps stall, so those households
+    are solved one by one with solve().
+
+    Parameters:
+
+    par: namespace
+        Parameters not given in columns. It is not changed.
+    maxiter: int
+        Max. number of projected gradient steps.
+    tol: float
+        Projected gradient stops for a household when no hour changes by more than tol.
+    columns: arrays
+        One value per household for any of the parameters, e.g. wF=..., nuM=..., alpha=..., sigma=...
+
+    Returns a namespace with LM, HM, LF, HF, u (as calc_utility) and interior (found by step 1), one value per household.
+    """
+
+    # a. columns
+    n = max([np.size(v) for v in columns.values()],default=1)
+    columns = {k:np.broadcast_to(np.asarray(v,dtype=float),(n,)) for k,v in columns.items()}
+    sigma = columns.get('sigma',np.full(n,float(par.sigma)))
+
+    res = SimpleNamespace()
+    for k in ['LM','HM','LF','HF','u']:
+        res.__dict__[k] = np.full(n,np.nan)
+    res.interior = np.zeros(n,dtype=bool)
+
+    # b. solve each branch of home production
+    for I in [sigma == 0, sigma == 1, (sigma != 0) & (sigma != 1)]:
+
+        if not I.any():
+            continue
+        
+        model = HouseholdSpecializationModelClass()
+        model.par = freeze(par,**{k:v[I] for k,v in columns.items()})
+
+        # i. kinked: one by one
+        if np.all(sigma[I] == 0):
+            for i in np.flatnonzero(I):
+                opt = solve_household(freeze(par,**{k:v[i] for k,v in columns.items()}),'solve')
+                res.LM[i],res.HM[i],res.LF[i],res.HF[i] = opt.LM,opt.HM,opt.LF,opt.HF
+            res.u[I] = model.calc_utility(res.LM[I],res.HM[I],res.LF[I],res.HF[I])
+            continue
+
+        # ii. smooth: vectorized
+        x,interior = _population_interior(model)
+        x[:,~interior] = _population_projected_gradient(model,~interior,maxiter,tol)
+
+        res.LM[I],res.HM[I],res.LF[I],res.HF[I] = x
+        res.u[I] = model.calc_utility(*x)
+        res.interior[I] = interior
+
+    return res
+
+def _population_interior(model,iterations=100):
+    """ interior optima from the first-order conditions (as in solve_reduced), found by vectorized golden section """
+
+    par = model.par
+    n = np.size(par.alpha*par.sigma*par.wF*par.wM*par.nuM*par.nuF*par.epsilon*par.omega)
+    bc = lambda v: np.broadcast_to(v,(n,)).astype(float)
+    alpha,sigma,wM,wF,nuM,nuF,epsilon = [bc(v) for v in [par.alpha,par.sigma,par.wM,par.wF,par.nuM,par.nuF,par.epsilon]]
+
+    # a. ratios implied by the first-order conditions
+    ok = (sigma > 0) & (alpha > 0) & (alpha < 1) & (nuM > 0) & (nuF > 0)
+    with np.errstate(all='ignore'):
+        k = (alpha/(1-alpha)*wM/wF)**sigma
+        m = (nuM/nuF*wF/wM)**epsilon
+        h = (1-par.omega)*(wM + wF*m)/(wM + wF*k)
+    ok &= (h <= 1) & (k*h <= m)
+    k,m,h = np.where(ok,k,1.0),np.where(ok,m,1.0),np.where(ok,h,0.5)
+
+    hours = lambda TM: np.array([TM*(1-h),TM*h,TM*(m-k*h),TM*k*h])
+    u = lambda TM: model.calc_utility(*hours(TM))
+
+    # b. golden section on [0,TM_max]
+    TM_max = np.fmin(24,24/m)
+    g = (np.sqrt(5)-1)/2
+    a,b = np.zeros(n),TM_max.copy()
+    c,d = b-g*(b-a),a+g*(b-a)
+    with np.errstate(all='ignore'):
+        uc,ud = u(c),u(d)
+        for _ in range(iterations):
+            left = uc >= ud # maximum in [a,d]
+            b = np.where(left,d,b)
+            a = np.where(left,a,c)
+            c_new = np.where(left,b-g*(b-a),d)
+            d_new = np.where(left,c,a+g*(b-a))
+            c,d = c_new,d_new
+            u_new = u(np.where(left,c,d))
+            uc,ud = np.where(left,u_new,ud),np.where(left,uc,u_new)
+
+    # c. interior if not at the 24 hour corner
+    TM = (a+b)/2
+    interior = ok & (TM < TM_max - 1e-6) & (TM > 1e-6)
+
+    return hours(TM),interior
+
+def _population_projected_gradient(model,J,maxiter,tol):
+    """ projected gradient ascent for the households in J, with Barzilai-Borwein steps and backtracking """
+
+    par_J = freeze(model.par,**{k:v[J] for k,v in _household_columns(model.par).items()})
+    sub = HouseholdSpecializationModelClass()
+
+    x = np.full((4,J.sum()),6.0)
+    step = np.full(x.shape[1],100.0)
+    active = np.arange(x.shape[1])
+    n_sub = -1
+
+    with np.errstate(all='ignore'):
+        for _ in range(maxiter):
+
+            if active.size == 0:
+                break
+
+            # i. parameters of the households still moving
+            if active.size != n_sub:
+                sub.par = freeze(par_J,**{k:v[active] for k,v in _household_columns(par_J).items()})
+                n_sub = active.size
+            
+            xa = x[:,active]
+            sa = step[active]
+            u = sub.calc_utility(*xa)
+            grad = sub.calc_utility_grad(*xa)
+
+            # ii. step with backtracking (Armijo) 
+            accepted = np.zeros(active.size,dtype=bool)
+            x_new = xa.copy()
+            for _ in range(40):
+                x_try = _project_hours(xa + sa*grad)
+                u_try = sub.calc_utility(*x_try)
+                ok = ~accepted & (u_try >= u + 1e-4*np.sum(grad*(x_try-xa),axis=0))
+                x_new[:,ok] = x_try[:,ok]
+                accepted |= ok
+                sa = np.where(accepted,sa,sa/2)
+                if accepted.all():
+                    break
+
+            # iii. next step length (Barzilai-Borwein)
+            dx = x_new-xa
+            dgrad = sub.calc_utility_grad(*x_new)-grad
+            curvature = -np.sum(dx*dgrad,axis=0)
+            bb = np.sum(dx*dx,axis=0)/curvature
+            sa = np.where((curvature > 0) & np.isfinite(bb),bb,sa*2)
+
+            # iv. update
+            change = np.max(np.abs(dx),axis=0)
+            x[:,active] = x_new
+            step[active] = sa
+            active = active[change > tol]
+
+    return x
+
+def _household_columns(par):
+    """ the parameters in par with one value per household """
+
+    return {k:v for k,v in par.__dict__.items() if np.ndim(v) == 1 and k != 'wF_vec'}
+
+def _project_hours(x):
+    """ project each member's (L,H) on L,H >= 0 and L+H <= 24 """
+
+    x = x.copy()
+    for L,H in [(0,1),(2,3)]:
         
+        # i. project on L+H = 24 where it is exceeded
+        excess = np.fmax(x[L]+x[H]-24,0)/2
+        x[L] -= excess
+        x[H] -= excess
+
+        # ii. non-negativity (keeping L+H = 24 on that line)
+        over = excess > 0
+        x[H] = np.where(over & (x[L] < 0),24,x[H])
+        x[L] = np.where(over & (x[H] < 0),24,x[L])
+        x[L] = np.fmax(x[L],0)
+        x[H] = np.fmax(x[H],0)
+
+    return x
+
+def tabulate_betas(par,axes,method='solve',executor=None):
+    """
+    (beta0,beta1) from solve_and_regress at every point of a grid of parameters, without changing any state
+
+    Parameters:
+
+    par: namespace
+        Parameters, the ones not in axes are kept fixed. It is not changed.
+    axes: dict
+        Grid values for each parameter, e.g. {'alpha':...,'sigma':...} or {'alpha':...,'sigma':...,'nuM':...,'nuF':...}.
+    method: str
+        Name of the solver, one of SOLVERS.
+    executor: concurrent.futures.Executor
+        If given, the grid points are solved in parallel on it.
+
+    Returns a namespace with names, axes and betas, an array of shape (len(axis) for each axis) + (2,).
+    """
+
+    names = tuple(axes)
+    grid_axes = [np.asarray(axes[name],dtype=float) for name in names]
+    shape = tuple(axis.size for axis in grid_axes)
+
+    # a. all grid points
+    pars = [freeze(par,**{name:axis[i] for name,axis,i in zip(names,grid_axes,index)}) for index in np.ndindex(*shape)]
+    
+    # b. solve
+    if executor is not None:
+        results = executor.map(solve_and_regress,pars,[method]*len(pars),chunksize=max(1,len(pars)//64))
+    else:
+        results = (solve_and_regress(par_i,method) for par_i in pars)
+
+    betas = np.array([(res.beta0,res.beta1) for res in results]).reshape(shape+(2,))
+
+    return SimpleNamespace(names=names,axes=grid_axes,betas=betas)
+
+def save_surface(surface,filename):
+    """ save a surface from tabulate_betas as filename.npy (betas) and filename_axes.npz (names and axes) """
+
+    np.save(f'{filename}.npy',surface.betas)
+    np.savez(f'{filename}_axes.npz',names=np.array(surface.names),**{f'axis{i}':axis for i,axis in enumerate(surface.axes)})
+
+def load_surface(filename,mmap=True):
+    """ load a surface saved with save_surface, with the betas memory-mapped if mmap """
+
+    betas = np.load(f'{filename}.npy',mmap_mode='r' if mmap else None)
+    with np.load(f'{filename}_axes.npz') as data:
+        names = tuple(str(name) for name in data['names'])
+        axes = [data[f'axis{i}'] for i in range(len(names))]
+
+    return SimpleNamespace(names=names,axes=axes,betas=betas)
+
+def _sample_starts(rng,n,names,bounds):
+    """ default starting points: the usual one for the parameters, then uniform draws within bounds """
+
+    usual = {'alpha':0.5,'sigma':1.0,'nuM':0.01,'nuF':0.01}
+    lower = np.array([b[0] for b in bounds])
+    upper = np.array([b[1] for b in bounds])
+
+    x0s = lower + (upper-lower)*rng.uniform(size=(n,len(names)))
+    if n > 0:
+        x0s[0] = [usual[name] for name in names]
+
+    return x0s
+
+def _add_counts(total,counts):
+    """ add the SLSQP iteration counts in counts to total """
+
+    for k in ['solves','nit','cold_solves','cold_nit']:
+        setattr(total,k,getattr(total,k)+getattr(counts,k))
+
+class _no_executor:
+    """ stands in for an executor in with-statements when solving serially """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self,*args):
+        return False
+
+
+class SolverStats:
+    """
+    Counters and timings, collected while par.instrument is True
+
+    calls, points and seconds are dicts by name: calc_utility, calc_utility_fused and 
+    calc_utility_grad (points are the evaluated choices), the solvers in SOLVERS (per household), 
+    regress, beta_jacobian, estimate and estimate_nu, and cache_hit. slsqp holds the solves, 
+    iterations, failures and seconds of SLSQP in solve by female wage.
+    """
+
+    def __init__(self):
         
+        self.calls = {}
+        self.points = {}
+        self.seconds = {}
+        self.slsqp = {}
+
+    def count(self,name,points=0,seconds=0.0):
+        """ add one call of name """
+
+        self.calls[name] = self.calls.get(name,0) + 1
+        self.points[name] = self.points.get(name,0) + int(points)
+        self.seconds[name] = self.seconds.get(name,0.0) + seconds
+
+    def count_slsqp(self,wF,nit,success,seconds):
+        """ add one SLSQP solve at the female wage wF """
+
+        row = self.slsqp.setdefault(float(wF),SimpleNamespace(solves=0,nit=0,failures=0,seconds=0.0))
+        row.solves += 1
+        row.nit += int(nit)
+        row.failures += int(not success)
+        row.seconds += seconds
+
+    def add(self,other):
+        """ add the counters and timings of other """
+
+        for name in other.calls:
+            self.calls[name] = self.calls.get(name,0) + other.calls[name]
+            self.points[name] = self.points.get(name,0) + other.points[name]
+            self.seconds[name] = self.seconds.get(name,0.0) + other.seconds[name]
+        
+        for wF,other_row in other.slsqp.items():
+            row = self.slsqp.setdefault(wF,SimpleNamespace(solves=0,nit=0,failures=0,seconds=0.0))
+            for k,v in other_row.__dict__.items():
+                row.__dict__[k] += v
+
+    def clear(self):
+        """ reset all counters and timings """
+
+        self.__init__()
+
+    def summary(self):
+        """ DataFrame of calls, points and seconds by name """
+
+        return pd.DataFrame({'calls':self.calls,'points':self.points,'seconds':self.seconds})
+
+    def slsqp_table(self):
+        """ DataFrame of SLSQP solves, iterations, failures and seconds by female wage """
+
+        table = pd.DataFrame.from_dict({wF:row.__dict__ for wF,row in self.slsqp.items()},orient='index',
+                                       columns=['solves','nit','failures','seconds'])
+        table.index.name = 'wF'
+
+        return table.sort_index()
+
+class SolutionCache:
+    """ least recently used cache of solutions, bounded to maxsize entries """
+
+    def __init__(self,maxsize=1024):
+
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,key):
+        """ entry for key (None if missing), marking it as recently used """
+
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        
+        self.misses += 1
+        return None
+
+    def put(self,key,entry):
+        """ store entry, evicting the least recently used entries when full """
+
+        if self.maxsize <= 0:
+            return
+
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """ remove all entries and reset the statistics """
+
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """ hit and miss statistics """
+
+        stats = SimpleNamespace()
+        stats.hits = self.hits
+        stats.misses = self.misses
+        stats.hit_rate = self.hits/(self.hits+self.misses) if self.hits+self.misses > 0 else np.nan
+        stats.size = len(self.entries)
+        stats.maxsize = self.maxsize
+
+        return stats
+
+    def save(self,filename):
+        """ save the entries to disk """
+
+        with open(filename,'wb') as f:
+            pickle.dump(list(self.entries.items()),f)
+
+    def load(self,filename):
+        """ add the entries saved in filename """
 
-                    
-        
\ No newline at end of file
+        with open(filename,'rb') as f:
+            for key,entry in pickle.load(f):
+                self.put(key,entry)
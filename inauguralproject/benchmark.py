@@ -0,0 +1,293 @@
+"""Benchmarks of the household specialization model
+
+Run all cases and write the results to a JSON file:
+
+    python benchmark.py run --out benchmark.json
+
+Compare against a stored baseline, flagging cases that got slower, use more memory
+or evaluate the objective more often:
+
+    python benchmark.py compare baseline.json benchmark.json
+
+Every case runs in its own process, so that its peak RSS is not mixed up with other cases.
+A case must do all its work in that process, since the counts and peak RSS do not cover worker processes.
+
+Checks of behaviour the cases do not cover (e.g. with several processes) are run by:
+
+    python benchmark.py check
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _setup_solve_discrete(model,n_grid):
+    model.par.n_grid = n_grid
+    return model.solve_discrete
+
+def _setup_solve(model):
+    return model.solve
+
+def _setup_solve_wF_vec(model,method,n_wages,n_grid=49):
+    model.par.n_grid = n_grid
+    model.par.wF_vec = np.linspace(0.8,1.2,n_wages)
+    model._allocate_wF_vec()
+    return lambda: model.solve_wF_vec(getattr(model,method))
+
+def _setup_estimate(model,method):
+    model.par.cache_size = 0
+    return lambda: model.estimate(method=getattr(model,method))
+
+def _setup_estimate_nu(model,method):
+    model.par.cache_size = 0
+    return lambda: model.estimate_nu(method=getattr(model,method))
+
+def _setup_estimate_multistart(model,n_starts,target_loss):
+    model.par.cache_size = 0
+    return lambda: model.estimate_multistart(n_starts=n_starts,n_workers=1,seed=0,
+                                             method=model.solve_reduced,target_loss=target_loss)
+
+def _setup_loop_alpha_sigma(model,n):
+    from loop_alpha_sigma import loop_alpha_sigma
+    alpha_vec = np.linspace(0.25,0.75,n)
+    sigma_vec = np.linspace(0.5,1.5,n)
+    return lambda: loop_alpha_sigma(alpha_vec,sigma_vec,do_print=False,n_workers=1)
+
+# name: (setup, keyword arguments), setup returns the function to time
+CASES = {
+    'solve_discrete[n_grid=25]': (_setup_solve_discrete,{'n_grid':25}),
+    'solve_discrete[n_grid=49]': (_setup_solve_discrete,{'n_grid':49}),
+    'solve': (_setup_solve,{}),
+    'solve_wF_vec[solve,n_wages=5]': (_setup_solve_wF_vec,{'method':'solve','n_wages':5}),
+    'solve_wF_vec[solve,n_wages=21]': (_setup_solve_wF_vec,{'method':'solve','n_wages':21}),
+    'solve_wF_vec[solve_discrete,n_wages=5,n_grid=25]': (_setup_solve_wF_vec,{'method':'solve_discrete','n_wages':5,'n_grid':25}),
+    'estimate[solve]': (_setup_estimate,{'method':'solve'}),
+    'estimate[solve_reduced]': (_setup_estimate,{'method':'solve_reduced'}),
+    'estimate_nu[solve_reduced]': (_setup_estimate_nu,{'method':'solve_reduced'}),
+    # (in one process, so that the counts and peak RSS cover all starts)
+    'estimate_multistart[n_starts=6,target_loss=50]': (_setup_estimate_multistart,{'n_starts':6,'target_loss':50.0}),
+    'loop_alpha_sigma[3x3]': (_setup_loop_alpha_sigma,{'n':3}),
+}
+
+QUICK = ('solve_discrete[n_grid=25]','solve','solve_wF_vec[solve,n_wages=5]','estimate[solve_reduced]',
+         'estimate_multistart[n_starts=6,target_loss=50]','loop_alpha_sigma[3x3]')
+
+
+def _check_multistart_cancel(model):
+    """estimate_multistart stops early with more starts than workers + 1, so that queued starts are cancelled"""
+
+    opt,table = model.estimate_multistart(n_starts=10,n_workers=2,seed=0,method=model.solve_reduced,target_loss=50.0)
+    assert opt.loss <= 50.0
+    assert (table['nfev'] == 0).any()
+
+# name: check, which raises if something is wrong
+CHECKS = {
+    'estimate_multistart_cancel': _check_multistart_cancel,
+}
+
+
+def _count_calls(cls,names,counts):
+    """Wraps the methods in names of cls to count calls and evaluated points in counts"""
+
+    for name in names:
+        method = getattr(cls,name)
+        counts[f'{name}_calls'] = 0
+        counts[f'{name}_points'] = 0
+
+        def counted(self,*args,_method=method,_name=name,**kwargs):
+            counts[f'{_name}_calls'] += 1
+            counts[f'{_name}_points'] += int(np.size(args[0]))
+            return _method(self,*args,**kwargs)
+
+        setattr(cls,name,counted)
+
+def run_case(name):
+    """Runs one case in the current process and returns its measurements"""
+
+    sys.path.insert(0,HERE)
+    import warnings
+    warnings.filterwarnings('ignore')
+    from HouseholdSpecializationModel import HouseholdSpecializationModelClass
+
+    # a. count objective evaluations
+    # (loop_alpha_sigma evaluates utility through calc_home_production)
+    counts = {}
+    _count_calls(HouseholdSpecializationModelClass,
+                 ('calc_utility','calc_utility_fused','calc_utility_grad','calc_home_production'),counts)
+
+    # b. set up
+    setup,kwargs = CASES[name]
+    model = HouseholdSpecializationModelClass()
+    func = setup(model,**kwargs)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # c. time
+    with np.errstate(all='ignore'):
+        t0 = time.perf_counter()
+        func()
+        wall = time.perf_counter() - t0
+
+    # d. peak RSS (kB on Linux)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {'wall':wall,'peak_rss_mb':rss/1024,'setup_rss_mb':rss_before/1024,'counts':counts}
+
+def run(names,repeat=3,do_print=True):
+    """Runs the cases in names, each repeat times in a fresh process, and returns the results"""
+
+    results = {}
+    for name in names:
+        walls = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable,os.path.abspath(__file__),'_case',name],
+                                 capture_output=True,text=True,check=True,cwd=HERE)
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            walls.append(res['wall'])
+
+        results[name] = {'wall_min':min(walls),'wall':walls,'peak_rss_mb':res['peak_rss_mb'],
+                         'setup_rss_mb':res['setup_rss_mb'],'counts':res['counts']}
+
+        if do_print:
+            print(f'{name:50s} {min(walls):9.3f} s {res["peak_rss_mb"]:9.1f} MB')
+
+    return results
+
+def check(names,do_print=True):
+    """Runs the checks in names, and returns those that failed"""
+
+    sys.path.insert(0,HERE)
+    import warnings
+    warnings.filterwarnings('ignore')
+    from HouseholdSpecializationModel import HouseholdSpecializationModelClass
+
+    failed = []
+    for name in names:
+        try:
+            with np.errstate(all='ignore'):
+                CHECKS[name](HouseholdSpecializationModelClass())
+            status = 'ok'
+        except Exception as error:
+            failed.append(name)
+            status = f'FAILED {type(error).__name__}: {error}'
+
+        if do_print:
+            print(f'{name:50s} {status}')
+
+    return failed
+
+def _meta():
+    """Environment of a run"""
+
+    try:
+        commit = subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,text=True,cwd=HERE).stdout.strip()
+    except OSError:
+        commit = ''
+
+    return {'date':datetime.now().isoformat(timespec='seconds'),'commit':commit,
+            'python':platform.python_version(),'numpy':np.__version__,
+            'platform':platform.platform(),'cpu_count':os.cpu_count()}
+
+def compare(baseline,results,threshold=0.2,rss_threshold=0.2,min_seconds=0.01,do_print=True):
+    """
+    Compares results to baseline (both as written by run) and returns the regressions
+
+    A case regresses if its fastest wall time grew by more than the threshold (a fraction) 
+    and by more than min_seconds, if its peak RSS grew by more than rss_threshold, or if it 
+    evaluates the objective at more points.
+    """
+
+    regressions = []
+    for name,new in results['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        old = baseline['cases'][name]
+
+        # a. time and memory
+        time_ratio = new['wall_min']/old['wall_min']
+        rss_ratio = new['peak_rss_mb']/old['peak_rss_mb']
+        flags = []
+        if time_ratio > 1+threshold and new['wall_min']-old['wall_min'] > min_seconds:
+            flags.append('time')
+        if rss_ratio > 1+rss_threshold:
+            flags.append('memory')
+
+        # b. objective evaluations
+        for k,v in new['counts'].items():
+            if k.endswith('_points') and v > old['counts'].get(k,v):
+                flags.append(k)
+
+        if flags:
+            regressions.append(name)
+
+        if do_print:
+            print(f'{name:50s} time x{time_ratio:5.2f} rss x{rss_ratio:5.2f} {" ".join(flags)}')
+
+    return regressions
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the household specialization model')
+    commands = parser.add_subparsers(dest='command',required=True)
+
+    p = commands.add_parser('run',help='run the cases and write the results')
+    p.add_argument('--out',default='benchmark.json')
+    p.add_argument('--case',action='append',choices=list(CASES),help='case to run, can be repeated (default all)')
+    p.add_argument('--quick',action='store_true',help='only run the fast cases')
+    p.add_argument('--repeat',type=int,default=3)
+
+    p = commands.add_parser('compare',help='flag regressions against a baseline')
+    p.add_argument('baseline')
+    p.add_argument('results')
+    p.add_argument('--threshold',type=float,default=0.2,help='allowed relative increase in wall time')
+    p.add_argument('--rss-threshold',type=float,default=0.2,help='allowed relative increase in peak RSS')
+    p.add_argument('--min-seconds',type=float,default=0.01,help='increases in wall time below this are ignored')
+
+    p = commands.add_parser('check',help='run the checks of behaviour the cases do not cover')
+    p.add_argument('--check',action='append',choices=list(CHECKS),help='check to run, can be repeated (default all)')
+
+    p = commands.add_parser('_case')
+    p.add_argument('name')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        names = args.case or (QUICK if args.quick else list(CASES))
+        results = {'meta':_meta(),'cases':run(names,args.repeat)}
+        with open(args.out,'w') as f:
+            json.dump(results,f,indent=2)
+
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.results) as f:
+            results = json.load(f)
+        regressions = compare(baseline,results,args.threshold,args.rss_threshold,args.min_seconds)
+        if regressions:
+            print(f'{len(regressions)} regression(s)')
+            return 1
+
+    elif args.command == 'check':
+        failed = check(args.check or list(CHECKS))
+        if failed:
+            print(f'{len(failed)} check(s) failed')
+            return 1
+
+    else:
+        print(json.dumps(run_case(args.name)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
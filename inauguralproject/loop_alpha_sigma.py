@@ -1,36 +1,103 @@
 from HouseholdSpecializationModel import HouseholdSpecializationModelClass
 import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 
-def loop_alpha_sigma(alpha_vec,sigma_vec):
-    """Returns the ratio of HF over HM using all possible values of alpha and sigma, using the discrete model"""
-    
+def loop_alpha_sigma(alpha_vec,sigma_vec,do_print=True,n_workers=None):
+    """Returns the ratio of HF over HM using all possible values of alpha and sigma, using the discrete model
+
+    Parameters:
+
+    alpha_vec: array; values of alpha
+    sigma_vec: array; values of sigma
+    do_print: bool; If True, the ratio of every (alpha, sigma) cell is printed
+    n_workers: int; number of processes the cells are spread across, defaults to the number of cores.
+        With 1 everything runs in the current process.
+    """
+
     # a. setting parameters
     model = HouseholdSpecializationModelClass()
     alpha_array = np.empty((len(alpha_vec),len(sigma_vec)))
     sigma_array = np.empty((len(alpha_vec),len(sigma_vec)))
     ratio_array = np.empty((len(alpha_vec),len(sigma_vec)))
 
-    # b. looping all the values of alpha and sigma
-    for alp_i in range(len(alpha_vec)):
-        for sig_i in range(len(sigma_vec)):
-            model.par.alpha = alpha_vec[alp_i]
-            model.par.sigma = sigma_vec[sig_i]
-            
-            # i. solve
-            opt = model.solve_discrete()
-
-            # ii. filter out whenever HM is 0 (ratio would be infinite)
-            if opt.HM == 0:
-                ratio = np.inf
-            else:
-                ratio = opt.HF / opt.HM
-            
-            # iii. print out results
+    cells = [(alpha,sigma) for alpha in alpha_vec for sigma in sigma_vec]
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    n_workers = max(1,min(n_workers,len(cells)))
+
+    # b. solving all the values of alpha and sigma
+    if n_workers == 1:
+        _init_worker(model.par)
+        ratios = [_solve_cell(cell) for cell in cells]
+        _init_worker(None)
+
+    else:
+        with ProcessPoolExecutor(n_workers,initializer=_init_worker,initargs=(model.par,)) as executor:
+            ratios = list(executor.map(_solve_cell,cells,chunksize=max(1,len(cells)//(4*n_workers))))
+
+    # c. storing (and printing) the results
+    for k,ratio in enumerate(ratios):
+        alp_i,sig_i = divmod(k,len(sigma_vec))
+
+        if do_print:
             print(f'(\u03B1, \u03C3) : ({alpha_vec[alp_i]:.2f}, {sigma_vec[sig_i]:.2F}) --> ratio ={ratio: .4F}')
 
-            alpha_array[alp_i,sig_i] = alpha_vec[alp_i]
-            sigma_array[alp_i,sig_i] = sigma_vec[sig_i]
-            ratio_array[alp_i,sig_i] = ratio
-    
-    return alpha_array, sigma_array, ratio_array
\ No newline at end of file
+        alpha_array[alp_i,sig_i] = alpha_vec[alp_i]
+        sigma_array[alp_i,sig_i] = sigma_vec[sig_i]
+        ratio_array[alp_i,sig_i] = ratio
+
+    return alpha_array, sigma_array, ratio_array
+
+
+# state shared by all cells solved in one process
+_sweep = None
+
+def _init_worker(par):
+    """Precomputes the parts of utility that do not depend on alpha and sigma"""
+
+    global _sweep
+
+    if par is None:
+        _sweep = None
+        return
+
+    model = HouseholdSpecializationModelClass()
+    model.par = par
+
+    # a. feasible choices, in the order of solve_discrete
+    LM,HM,LF,HF = model._feasible_grid()
+    LM = np.repeat(LM,LF.size)
+    HM = np.repeat(HM,LF.size)
+    LF = np.tile(LF,LM.size//LF.size)
+    HF = np.tile(HF,LM.size//HF.size)
+
+    # b. consumption and disutility
+    C_ = (par.wM*LM + par.wF*LF)**par.omega
+    disutility = model.calc_disutility(LM,HM,LF,HF)
+
+    _sweep = (model,LM,HM,LF,HF,C_,disutility)
+
+def _solve_cell(cell):
+    """Returns HF/HM at the discrete optimum for one (alpha, sigma)"""
+
+    model,LM,HM,LF,HF,C_,disutility = _sweep
+    par = model.par
+    par.alpha,par.sigma = cell
+
+    # i. solve, as in solve_discrete
+    with np.errstate(all='ignore'):
+        H = model.calc_home_production(LM,HM,LF,HF)
+        Q = C_*H**(1-par.omega)
+        u = np.fmax(Q,1e-8)**(1-par.rho)/(1-par.rho) - disutility
+    j = np.argmax(u)
+
+    # ii. filter out whenever HM is 0 (ratio would be infinite)
+    if HM[j] == 0:
+        ratio = np.inf
+    else:
+        ratio = HF[j] / HM[j]
+
+    return ratio
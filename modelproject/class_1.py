@@ -3,8 +3,15 @@ import random as rand
 import functions_1 as f
 
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import itertools
+import collections
+import copy
+import pickle
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 class person:
     def __init__(self, id, max_p, curr_d_p, min_rw, curr_s_w):
@@ -42,9 +49,53 @@ class firm:
         self.rw_curr_surplus = 0
         self.employed = False
 
+class person_arrays:
+    def __init__(self, max_p, curr_d_p, min_rw, curr_s_w):
+        """All persons, with one array element per person (same fields as person)"""
+
+        n = len(max_p)
+        
+        # a. identification
+        self.id = np.arange(n)
+
+        # b. good market parameters
+        self.max_p = np.asarray(max_p,dtype=float)
+        self.curr_p = np.full(n,curr_d_p,dtype=float)
+        self.p_curr_surplus = np.zeros(n)
+        self.bought = np.zeros(n,dtype=bool)
+
+        # c. labor market parameters
+        self.min_rw = np.asarray(min_rw,dtype=float)
+        self.curr_w = np.full(n,curr_s_w,dtype=float)
+        self.rw_curr_surplus = np.ones(n)
+        self.worked = np.zeros(n,dtype=bool)
+
+
+
+class firm_arrays:
+    def __init__(self, min_p, curr_s_p, max_rw, curr_d_w):
+        """All firms, with one array element per firm (same fields as firm)"""
+
+        n = len(min_p)
+
+        # a. identification
+        self.id = np.arange(n)
+
+        # b. good market parameters
+        self.min_p = np.asarray(min_p,dtype=float)
+        self.curr_p = np.full(n,curr_s_p,dtype=float)
+        self.p_curr_surplus = np.zeros(n)
+        self.sold = np.zeros(n,dtype=bool)
+
+        # c. labor market parameters
+        self.max_rw = np.asarray(max_rw,dtype=float)
+        self.curr_w = np.full(n,curr_d_w,dtype=float)
+        self.rw_curr_surplus = np.zeros(n)
+        self.employed = np.zeros(n,dtype=bool)
+
 class economy_simulation:
 
-    def __init__(self, p_dem_func=None, p_sup_func=None,initial_p=None, rw_dem_func=None, rw_sup_func=None, initial_w=None , n_days=30, n_persons=25, n_firms=25,only_goods=False,only_labor=False):
+    def __init__(self, p_dem_func=None, p_sup_func=None,initial_p=None, rw_dem_func=None, rw_sup_func=None, initial_w=None , n_days=30, n_persons=25, n_firms=25,only_goods=False,only_labor=False,engine="objects",matching="full",k_partners=5,clearing="random",seed=None):
         """Creates an economy simulation
         
         Parameters:
@@ -67,6 +118,21 @@ class economy_simulation:
         Other:
         only_goods: bool; If true, only the good market will be simulated, and you don't need to input the Labor Market Parameters.
         only_labor: bool; If true, only the labor market will be simulated and you don't need to input the Good Market Parameters (except the initial price).
+        engine: str; "objects" simulates every person and firm as an object, "arrays" keeps all agents in NumPy arrays 
+            and does each day's interactions in batches (see simulation_arrays). Both give the same results in distribution.
+            "arrays" shuffles the pairs with NumPy, so for a given seed the series differ from "objects". They are
+            identical only through simulation_arrays(same_shuffle=True).
+
+        Matching:
+        matching: str; "full" makes every person meet every firm in each market every day, in random order.
+            "sampled" makes every person meet k_partners different random firms, so the number of meetings 
+            grows linearly (not quadratically) with the number of agents.
+        k_partners: int; number of firms every person meets per market and day, when matching is "sampled"
+        clearing: str; "random" clears the markets through the random meetings of matching. "order_book" instead 
+            matches the highest bids with the lowest asks every day (see functions_1.order_book_trade), 
+            which gives the equilibrium quantity at today's prices and wages
+        seed: int; If given, every simulation draws from its own random.Random(seed), so it can be reproduced. 
+            Else, the global random generator is used.
         """
         # a. error handling
         assert (not only_goods or not only_labor)
@@ -112,206 +178,844 @@ class economy_simulation:
             par.initial_w = initial_w
 
         par.only_labor = only_labor
+
+        # f. simulation engine
+        assert engine in ("objects","arrays")
+        par.engine = engine
+
+        # g. matching
+        assert matching in ("full","sampled")
+        par.matching = matching
+        par.k_partners = k_partners
+
+        # h. market clearing
+        assert clearing in ("random","order_book")
+        par.clearing = clearing
+
+        # i. random numbers
+        par.seed = seed
+
+        # j. state of the last simulation (see checkpoint)
+        self.state = None
     
-    def simulation(self,do_print=False):
+    def simulation(self,do_print=False,tol=None,window=20,path=None):
+        """Runs the simulation and returns the series named in series_names, as a simulation_result
+
+        Parameters:
+
+        do_print: bool; If True, the results of every day are printed
+        tol: float; If given, the run stops once it is steady, see simulation_days. The series then end at that day.
+        window: int; see simulation_days
+        path: str; If given, the series are written to a memory-mapped .npy file at path (see simulation_result)
+        """
+
+        days = self.simulation_days(do_print,tol,window,path)
+
+        return self._collect(days,self.state)
+
+    def simulation_arrays(self,do_print=False,same_shuffle=False):
+        """Runs the same simulation as simulation, with all agents in NumPy arrays
+
+        The interactions of a day are done in batches (see functions_1.trade_arrays and 
+        functions_1.labor_market_arrays) instead of one pair at a time. 
+        
+        Parameters:
+        
+        do_print: bool; If True, the results of every day are printed
+        same_shuffle: bool; If True, the pairs are shuffled with the same calls to random as in simulation,
+            so for a given random.seed (or seed) the results are identical. Else, NumPy (seeded from random) 
+            shuffles the pairs, which is much faster for many agents.
+        """
+
+        state = self._start("arrays",same_shuffle)
+
+        return self._collect(self._days(state,do_print),state)
+
+    def simulation_days(self,do_print=False,tol=None,window=20,path=None):
+        """Yields the results of every day as soon as it is simulated
+
+        Every day is a namespace with day, price, wage, real_wage, g_demand, g_supply, l_demand and l_supply
+        (None for a market that is not simulated).
+
+        Parameters:
+
+        do_print: bool; If True, the results of every day are printed
+        tol: float; If given, the run stops early once the price and the wage have stayed inside a band of 
+            relative width tol (max - min at most tol times the mean) for window days in a row
+        window: int; number of days the price and wage must stay inside the band
+        path: str; If given, the series are written to a memory-mapped .npy file at path (see simulation_result)
+        """
+
+        return self._days(self._start(self.par.engine,path=path),do_print,tol,window)
+
+    def checkpoint(self):
+        """Snapshot of the last simulation (at its last simulated day), which extend can continue from
+
+        It holds the agents, the order of the pairs, the state of the random generators and the series so far,
+        and can be pickled (see save_checkpoint). It is only valid for an economy_simulation with the same parameters.
+        """
+
+        assert self.state is not None, "there is no simulation to checkpoint"
+        state = self.state
+
+        # a. everything except the random generator, which may be the random module itself
+        snap = copy.deepcopy(SimpleNamespace(**{k:v for k,v in state.__dict__.items() if k != "rand"}))
+        snap.rand_state = state.rand.getstate()
+        
+        # b. parameters it must be continued with
+        snap.settings = self._settings()
+
+        return snap
+
+    def extend(self,n_days,checkpoint=None,do_print=False):
+        """Simulates n_days more days and returns the whole series so far, as simulation does
+
+        Only the new days are simulated. The run can be extended again, or checkpointed.
+
+        Parameters:
+
+        n_days: int; number of days to add
+        checkpoint: namespace; If given (see checkpoint), the days are added to a copy of it, so the same
+            checkpoint can be extended in several ways. Else, the last simulation is continued 
+            (and if it was written to a file through path, the new days are added to the file).
+        do_print: bool; If True, the results of every new day are printed
+        """
+
+        # a. state to continue
+        if checkpoint is None:
+            assert self.state is not None, "there is no simulation to extend"
+            state = self.state
+        
+        else:
+            assert checkpoint.settings == self._settings(), "the checkpoint is from a simulation with other parameters"
+            state = copy.deepcopy(checkpoint)
+            state.rand = rand.Random()
+            state.rand.setstate(state.__dict__.pop("rand_state"))
+            del state.settings
+            self.state,self.rand = state,state.rand
+
+        # b. simulate
+        days = self._days(state,do_print,end=state.day+n_days)
+
+        return self._collect(days,state)
+
+    def save_checkpoint(self,path,checkpoint=None):
+        """Pickles checkpoint (or a checkpoint of the last simulation) to path"""
+
+        if checkpoint is None:
+            checkpoint = self.checkpoint()
+
+        with open(path,"wb") as file:
+            pickle.dump(checkpoint,file,protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load_checkpoint(path):
+        """Loads a checkpoint saved by save_checkpoint"""
+
+        with open(path,"rb") as file:
+            return pickle.load(file)
+
+    def _settings(self):
+        """Parameters a checkpoint must be continued with"""
 
-        # a. setup
         par = self.par
-        inflation = par.initial_p
-
-        # b. simulations
-        persons = [person(i,par.p_dem_func(i+1),par.initial_p,par.rw_sup_func(i+1),par.initial_w) for i in range(par.n_persons)]
-        firms = [firm(i,par.p_sup_func(i+1),par.initial_p,par.rw_dem_func(i+1),par.initial_w) for i in range(par.n_firms)]
-        
-        # c. create every single combination of persons and firms
-        poss_comb = list(itertools.product(persons,firms))
-        poss_comb = [list(comb) for comb in poss_comb]
-        
-        # d. accounting setup
-        inflation_list = []
-        wage_list = []
-        g_demand_list = []
-        g_supply_list = []
-        l_demand_list = []
-        l_supply_list = []
-
-        # e. day simulation
-        for day in range(par.n_days):
-            
-            # i. labor supply and demand accounting setup
-            l_Supply = 0
-            l_Demand = 0
 
-            # ii. initiate the labor market
-            if not par.only_goods:
+        return (par.n_persons,par.n_firms,par.only_goods,par.only_labor,par.matching,par.k_partners,par.clearing)
+
+    def _days(self,state,do_print=False,tol=None,window=20,end=None):
+        """Simulates and yields the days from state.day until end (default n_days), or a steady state (see simulation_days)"""
+
+        par = self.par
+        end = par.n_days if end is None else end
+        recent = collections.deque(maxlen=window)
+        state.series.reserve(end)
+
+        try:
+            while state.day < end:
                 
-                # 1. accounting for all interaction's equilibrium wages
-                day_w_list = []
+                # a. simulate
+                day = self._day(state)
+                state.series.append(day)
 
-                # 2. shuffle the combinations 
-                rand.shuffle(poss_comb)
+                # b. print
+                if do_print:
+                    self._print_day(day)
 
-                # 3. doing all interactions
-                for chosen_pair in poss_comb:
+                yield day
 
-                    chosen_worker, chosen_employer = chosen_pair
-                    inter_w = f.labor_market(chosen_worker,chosen_employer,inflation)
+                # c. stop in a steady state
+                if tol is not None:
+                    recent.append([v for v in (day.price,day.wage) if v is not None])
+                    if len(recent) == window and _steady(recent,tol):
+                        return
+        
+        finally: # (also when the run stops early, or is not iterated to the end)
+            state.series.trim()
 
-                    # o. cleaning all the unsuccessful interactions
-                    if str(inter_w) != "nan":
-                        day_w_list.append(inter_w)
-                
-                # 4. calculate today's average wage and store it
-                if day_w_list != []:
-                    day_w = sum(day_w_list)/len(day_w_list)
-                
-                else:
-                    if day == 0:
-                        day_w = par.initial_w
-                    
-                    else:
-                        day_w = wage_list[-1]
-   
-                wage_list.append(day_w)
-
-                # 5. update all parameters and calculate demand and supply
-                list_persons = []
-                
-                for chosen_pair in poss_comb:
-                    chosen_worker, chosen_employer = chosen_pair
-                    
-                    if chosen_worker not in list_persons:
-                        list_persons.append(chosen_worker)
-                        
-                        # o. update workers
-                        if not chosen_worker.worked:
-                            chosen_worker.curr_w -= 1
-                        else:
-                            chosen_worker.worked = False
-                        
-                        # oo. calculate labor supply
-                        if day_w >= int(chosen_worker.min_rw*inflation)+1:
-                            l_Supply += 1
-
-                    if chosen_employer not in list_persons:
-                        list_persons.append(chosen_employer)
-                        
-                        # o. update employers
-                        if not chosen_employer.employed:
-                            chosen_employer.curr_w += 1
-                        else:
-                            chosen_employer.employed = False
-                        
-                        # oo. calculate labor demand
-                        if day_w <= int(chosen_employer.max_rw*inflation):
-                            l_Demand += 1
-                
-                # 6. store labor demand and supply
-                l_demand_list.append(l_Demand)
-                l_supply_list.append(l_Supply)
-
-            # iii. goods supply and demand accounting setup
-            g_Demand = 0
-            g_Supply = 0
-
-            # iv. initiate goods market
-            if not par.only_labor:
-                # 1. accounting for all interaction's equilibrium prices
-                p_list = []
-                
-                # 2. shuffle the combinations
-                rand.shuffle(poss_comb)
+    def _start(self,engine,same_shuffle=False,path=None):
+        """State of a simulation at day 0, with the agents as objects or in arrays depending on engine"""
+
+        par = self.par
+
+        # a. time and prices
+        state = self.state = SimpleNamespace(engine=engine,day=0,inflation=par.initial_p,day_w=par.initial_w)
+        state.series = simulation_result(self.series_names(),par.n_days,path)
+        
+        # b. random numbers
+        state.rand = self.rand = rand if par.seed is None else rand.Random(par.seed)
+        state.rng = np.random.default_rng(state.rand.getrandbits(64)) if engine == "arrays" and not same_shuffle else None
+
+        # c. simulations
+        if engine == "objects":
+            state.persons = [person(i,par.p_dem_func(i+1),par.initial_p,par.rw_sup_func(i+1),par.initial_w) for i in range(par.n_persons)]
+            state.firms = [firm(i,par.p_sup_func(i+1),par.initial_p,par.rw_dem_func(i+1),par.initial_w) for i in range(par.n_firms)]
+        
+        else:
+            state.persons = person_arrays([par.p_dem_func(i+1) for i in range(par.n_persons)],par.initial_p,
+                                          [par.rw_sup_func(i+1) for i in range(par.n_persons)],par.initial_w)
+            state.firms = firm_arrays([par.p_sup_func(i+1) for i in range(par.n_firms)],par.initial_p,
+                                      [par.rw_dem_func(i+1) for i in range(par.n_firms)],par.initial_w)
+
+        # d. create every single combination of persons and firms 
+        # (in arrays, pair k is person k // n_firms and firm k % n_firms)
+        state.poss_comb = None
+        if par.matching == "full" and par.clearing == "random":
+            
+            if engine == "objects":
+                poss_comb = list(itertools.product(state.persons,state.firms))
+                state.poss_comb = [list(comb) for comb in poss_comb]
+            
+            elif same_shuffle:
+                state.poss_comb = list(range(par.n_persons*par.n_firms))
+            
+            else:
+                state.poss_comb = np.arange(par.n_persons*par.n_firms)
+
+        return state
+
+    def _day(self,state):
+        """Simulates one day, updating state, and returns its results"""
+
+        par = self.par
+        self.rand = state.rand
+        day = SimpleNamespace(day=state.day,price=None,wage=None,real_wage=None,
+                              g_demand=None,g_supply=None,l_demand=None,l_supply=None)
+
+        # a. labor market
+        if not par.only_goods:
+            if state.engine == "objects":
+                day.wage,day.l_demand,day.l_supply = self._labor_market_objects(state)
+            else:
+                day.wage,day.l_demand,day.l_supply = self._labor_market_arrays(state)
+
+        # b. goods market
+        if not par.only_labor:
+            if state.engine == "objects":
+                day.price,day.g_demand,day.g_supply = self._goods_market_objects(state)
+            else:
+                day.price,day.g_demand,day.g_supply = self._goods_market_arrays(state)
+
+        # c. real wage
+        if not par.only_goods:
+            day.real_wage = day.wage/state.inflation
+        
+        state.day += 1
+
+        return day
+
+    def _labor_market_objects(self,state):
+        """One day of the labor market with the agents as objects: returns today's wage, labor demand and supply"""
+
+        par = self.par
+        persons,firms,inflation = state.persons,state.firms,state.inflation
+
+        # i. labor supply and demand accounting setup
+        l_Supply = 0
+        l_Demand = 0
                 
-                # 3. doing all interactions
-                for chosen_pair in poss_comb:
-                    
-                    chosen_buyer, chosen_seller = chosen_pair
-                    p = f.trade(chosen_buyer,chosen_seller)
-                    
-                    # o. cleaning all the unsuccessful interactions
-                    if str(p) != "nan":
-                        p_list.append(p)
+        # 1. accounting for all interaction's equilibrium wages
+        day_w_list = []
+
+        # 2. shuffle the combinations (or draw today's meetings, or clear the market in an order book)
+        if par.clearing == "order_book":
+            day_w_list = f.order_book_labor_market(persons,firms,inflation)
+            meetings = []
+        elif par.matching == "full":
+            self.rand.shuffle(state.poss_comb)
+            meetings = state.poss_comb
+        else:
+            meetings = self._sampled_pairs(persons,firms)
+
+        # 3. doing all interactions
+        for chosen_pair in meetings:
+
+            chosen_worker, chosen_employer = chosen_pair
+            inter_w = f.labor_market(chosen_worker,chosen_employer,inflation)
+
+            # o. cleaning all the unsuccessful interactions
+            if str(inter_w) != "nan":
+                day_w_list.append(inter_w)
+        
+        # 4. calculate today's average wage (else keep the initial wage or yesterday's)
+        if day_w_list != []:
+            state.day_w = sum(day_w_list)/len(day_w_list)
+
+        day_w = state.day_w
+
+        # 5. update all parameters and calculate demand and supply, once for every agent
+        # (every agent is in a pair, and each agent's update only depends on itself, so the order does not matter)
+        for chosen_worker in persons:
                 
-                # 4. calculate today's average price and store it
-                if p_list != []:
-                    inflation = sum(p_list)/len(p_list)
-
-                inflation_list.append(inflation)
-
-                # 5. update all parameters and calculate demand and supply
-                list_persons = []
-
-                for chosen_pair in poss_comb:
-                    chosen_buyer, chosen_seller = chosen_pair
-                    
-                    if chosen_buyer not in list_persons:
-                        list_persons.append(chosen_buyer)
-                        
-                        # o. update buyers
-                        if not chosen_buyer.bought:
-                            chosen_buyer.curr_p += 1
-                        else:
-                            chosen_buyer.bought = False
-                        
-                        # oo. calculate goods demand
-                        if inflation <= chosen_buyer.max_p:
-                            g_Demand += 1
-                    
-                    if chosen_seller not in list_persons:
-                        list_persons.append(chosen_seller)
-                        
-                        # o. update sellers
-                        if not chosen_seller.sold:
-                            chosen_seller.curr_p -= 1
-                        else:
-                            chosen_seller.sold = False
-                        
-                        # oo. calculate goods supply
-                        if inflation >= chosen_seller.min_p:
-                            g_Supply += 1
-
-                # 6. store goods demand and supply
-                g_demand_list.append(g_Demand)
-                g_supply_list.append(g_Supply)
+            # o. update workers
+            if not chosen_worker.worked:
+                chosen_worker.curr_w -= 1
+            else:
+                chosen_worker.worked = False
+            
+            # oo. calculate labor supply
+            if day_w >= int(chosen_worker.min_rw*inflation)+1:
+                l_Supply += 1
+
+        for chosen_employer in firms:
                 
-            # v. printing message
-            if do_print:
-                print(f'day {day}:')
+            # o. update employers
+            if not chosen_employer.employed:
+                chosen_employer.curr_w += 1
+            else:
+                chosen_employer.employed = False
+            
+            # oo. calculate labor demand
+            if day_w <= int(chosen_employer.max_rw*inflation):
+                l_Demand += 1
+
+        return day_w, l_Demand, l_Supply
+
+    def _goods_market_objects(self,state):
+        """One day of the goods market with the agents as objects: returns today's price, goods demand and supply"""
+
+        par = self.par
+        persons,firms = state.persons,state.firms
+
+        # i. goods supply and demand accounting setup
+        g_Demand = 0
+        g_Supply = 0
+
+        # 1. accounting for all interaction's equilibrium prices
+        p_list = []
+        
+        # 2. shuffle the combinations (or draw today's meetings, or clear the market in an order book)
+        if par.clearing == "order_book":
+            p_list = f.order_book_trade(persons,firms)
+            meetings = []
+        elif par.matching == "full":
+            self.rand.shuffle(state.poss_comb)
+            meetings = state.poss_comb
+        else:
+            meetings = self._sampled_pairs(persons,firms)
+        
+        # 3. doing all interactions
+        for chosen_pair in meetings:
+            
+            chosen_buyer, chosen_seller = chosen_pair
+            p = f.trade(chosen_buyer,chosen_seller)
+            
+            # o. cleaning all the unsuccessful interactions
+            if str(p) != "nan":
+                p_list.append(p)
+        
+        # 4. calculate today's average price
+        if p_list != []:
+            state.inflation = sum(p_list)/len(p_list)
+
+        inflation = state.inflation
 
-                ending_phrase = ""
+        # 5. update all parameters and calculate demand and supply, once for every agent
+        for chosen_buyer in persons:
                 
-                # i. goods market
-                if not par.only_labor:
-                    ending_phrase += f"Today's price: {inflation:.0f}, D: {g_Demand}, S: {g_Supply}"
-                    
-                    if not par.only_goods:
-                        ending_phrase += "\n"
+            # o. update buyers
+            if not chosen_buyer.bought:
+                chosen_buyer.curr_p += 1
+            else:
+                chosen_buyer.bought = False
+            
+            # oo. calculate goods demand
+            if inflation <= chosen_buyer.max_p:
+                g_Demand += 1
+        
+        for chosen_seller in firms:
                 
-                # ii. labor market
-                if not par.only_goods:
-                    ending_phrase += f"Today's wage: {day_w:.0f}, Real wage: {day_w/inflation:.2f}, D: {l_Demand}, S: {l_Supply}"
+            # o. update sellers
+            if not chosen_seller.sold:
+                chosen_seller.curr_p -= 1
+            else:
+                chosen_seller.sold = False
+            
+            # oo. calculate goods supply
+            if inflation >= chosen_seller.min_p:
+                g_Supply += 1
+
+        return inflation, g_Demand, g_Supply
+
+    def _labor_market_arrays(self,state):
+        """One day of the labor market with the agents in arrays: returns today's wage, labor demand and supply"""
 
-                print(ending_phrase)
+        par = self.par
+        persons,firms,inflation = state.persons,state.firms,state.inflation
+
+        # 1. doing all interactions (or clearing the market in an order book)
+        if par.clearing == "order_book":
+            day_w_list = f.order_book_labor_market_arrays(persons,firms,inflation)
+        else:
+            workers,employers = self._pairs_arrays(state.poss_comb,state.rng)
+            day_w_list = f.labor_market_arrays(persons,firms,workers,employers,inflation)
+        
+        # 2. calculate today's average wage (else keep the initial wage or yesterday's)
+        if day_w_list != []:
+            state.day_w = sum(day_w_list)/len(day_w_list)
+
+        day_w = state.day_w
+
+        # 3. update workers
+        persons.curr_w[~persons.worked] -= 1
+        persons.worked[:] = False
+        
+        # 4. update employers
+        firms.curr_w[~firms.employed] += 1
+        firms.employed[:] = False
+        
+        # 5. calculate labor demand and supply
+        l_Supply = int(np.sum(day_w >= np.trunc(persons.min_rw*inflation)+1))
+        l_Demand = int(np.sum(day_w <= np.trunc(firms.max_rw*inflation)))
+
+        return day_w, l_Demand, l_Supply
+
+    def _goods_market_arrays(self,state):
+        """One day of the goods market with the agents in arrays: returns today's price, goods demand and supply"""
+
+        par = self.par
+        persons,firms = state.persons,state.firms
+
+        # 1. doing all interactions (or clearing the market in an order book)
+        if par.clearing == "order_book":
+            p_list = f.order_book_trade_arrays(persons,firms)
+        else:
+            buyers,sellers = self._pairs_arrays(state.poss_comb,state.rng)
+            p_list = f.trade_arrays(persons,firms,buyers,sellers)
+        
+        # 2. calculate today's average price
+        if p_list != []:
+            state.inflation = sum(p_list)/len(p_list)
+
+        inflation = state.inflation
+
+        # 3. update buyers
+        persons.curr_p[~persons.bought] += 1
+        persons.bought[:] = False
+
+        # 4. update sellers
+        firms.curr_p[~firms.sold] -= 1
+        firms.sold[:] = False
+
+        # 5. calculate goods demand and supply
+        g_Demand = int(np.sum(inflation <= persons.max_p))
+        g_Supply = int(np.sum(inflation >= firms.min_p))
+
+        return inflation, g_Demand, g_Supply
+
+    def _print_day(self,day):
+        """Prints the results of a day"""
+
+        par = self.par
+        
+        print(f'day {day.day}:')
+
+        ending_phrase = ""
+        
+        # i. goods market
+        if not par.only_labor:
+            ending_phrase += f"Today's price: {day.price:.0f}, D: {day.g_demand}, S: {day.g_supply}"
+            
+            if not par.only_goods:
+                ending_phrase += "\n"
+        
+        # ii. labor market
+        if not par.only_goods:
+            ending_phrase += f"Today's wage: {day.wage:.0f}, Real wage: {day.real_wage:.2f}, D: {day.l_demand}, S: {day.l_supply}"
+
+        print(ending_phrase)
+
+    def _collect(self,days,state):
+        """Runs through days and returns the series of state, up to its last day"""
+
+        for day in days:
+            pass
+
+        return state.series.view()
+
+    def series_names(self):
+        """Names of the series returned by simulation, in order"""
+
+        par = self.par
 
-        # f. output handling   
         if par.only_goods:
-            return inflation_list, g_demand_list, g_supply_list
+            return ["price","g_demand","g_supply"]
         
         elif par.only_labor:
-            return wage_list, l_demand_list, l_supply_list
+            return ["wage","l_demand","l_supply"]
         
         else:
-            return inflation_list,g_demand_list, g_supply_list, wage_list, l_demand_list, l_supply_list
-            
+            return ["price","g_demand","g_supply","wage","l_demand","l_supply"]
 
+    def ensemble(self,n_runs,seed=None,n_workers=None,quantiles=(0.05,0.5,0.95)):
+        """Runs the simulation n_runs times, each with its own seeded random generator, spread over processes
+
+        Parameters:
+
+        n_runs: int; number of simulations
+        seed: int; seed from which the seeds of the runs are derived (with numpy.random.SeedSequence), 
+            so the same seed gives the same ensemble for any n_workers
+        n_workers: int; number of processes, defaults to the number of cores. With 1 everything runs in the current process.
+        quantiles: tuple; quantiles of every series computed over the runs
+
+        Returns a namespace with, for every series in series_names: all runs in runs[name] (an (n_runs,n_days) array),
+        their mean in mean[name] and their quantiles in quantiles[name] (a (len(quantiles),n_days) array).
+        The seed of every run is in seeds.
+        """
+
+        par = self.par
+        names = self.series_names()
+
+        # a. one seed per run
+        seeds = [int(child.generate_state(1,np.uint64)[0]) for child in np.random.SeedSequence(seed).spawn(n_runs)]
+
+        if n_workers is None:
+            n_workers = os.cpu_count()
+        n_workers = max(1,min(n_workers,n_runs))
+
+        # b. run, keeping running sums for the mean
+        runs = np.empty((len(names),n_runs,par.n_days))
+        total = np.zeros((len(names),par.n_days))
+
+        if n_workers == 1:
+            results = map(self._seeded_run,seeds)
+            executor = None
+        
+        else: # (forked workers inherit the demand and supply functions, which need not be picklable)
+            context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+            executor = ProcessPoolExecutor(n_workers,mp_context=context,initializer=_init_ensemble,initargs=(self,))
+            results = executor.map(_run_ensemble,seeds,chunksize=max(1,n_runs//(4*n_workers)))
+
+        try:
+            for i,result in enumerate(results):
+                runs[:,i] = result
+                total += runs[:,i]
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # c. output
+        out = SimpleNamespace(seeds=seeds,quantile_levels=tuple(quantiles),runs={},mean={},quantiles={})
+        bands = np.quantile(runs,quantiles,axis=1)
+        
+        for j,name in enumerate(names):
+            out.runs[name] = runs[j]
+            out.mean[name] = total[j]/n_runs
+            out.quantiles[name] = bands[:,j]
+
+        return out
+
+    def _seeded_run(self,seed):
+        """Runs the simulation with its own random.Random(seed) and returns the series as an array"""
+
+        run = copy.copy(self)
+        run.par = SimpleNamespace(**{**self.par.__dict__,"seed":seed})
+
+        return np.asarray(run.simulation())
+
+    def _sampled_pairs(self,persons,firms):
+        """Yields the (person, firm) meetings of a market phase when matching is "sampled"
+
+        Every person gets k_partners different firms. The meetings are made in k_partners rounds,
+        in each of which all persons meet their next firm in random order.
+        """
+
+        k = min(self.par.k_partners,len(firms))
+
+        # a. partners of every person
+        partners = [self.rand.sample(firms,k) for _ in persons]
+
+        # b. rounds
+        order = list(range(len(persons)))
+        for r in range(k):
+            self.rand.shuffle(order)
+            for i in order:
+                yield persons[i], partners[i][r]
+
+    def _pairs_arrays(self,poss_comb,rng):
+        """Returns the (person, firm) indices of the meetings of a market phase in simulation_arrays
+
+        poss_comb is shuffled in place (if matching is "full"). If rng is None, the same calls to self.rand 
+        are made as in simulation.
+        """
+
+        par = self.par
+
+        # a. same calls to random as in simulation
+        if rng is None:
+            if par.matching == "full":
+                self.rand.shuffle(poss_comb)
+                pairs = np.array(poss_comb)
+                return pairs // par.n_firms, pairs % par.n_firms
             
-                
-            
-                
-                
+            pairs = np.array(list(self._sampled_pairs(range(par.n_persons),range(par.n_firms))),dtype=int).reshape(-1,2)
+            return pairs[:,0], pairs[:,1]
+
+        # b. full matching
+        if par.matching == "full":
+            rng.shuffle(poss_comb)
+            return poss_comb // par.n_firms, poss_comb % par.n_firms
+        
+        # c. sampled matching: k different partners for every person
+        k = min(par.k_partners,par.n_firms)
+        if 2*k > par.n_firms:
+            partners = rng.permuted(np.tile(np.arange(par.n_firms),(par.n_persons,1)),axis=1)[:,:k]
+        else:
+            partners = rng.integers(0,par.n_firms,(par.n_persons,k))
+            while True: # draw again for persons with the same firm twice
+                sorted_partners = np.sort(partners,axis=1)
+                I = np.any(sorted_partners[:,1:] == sorted_partners[:,:-1],axis=1)
+                if not I.any():
+                    break
+                partners[I] = rng.integers(0,par.n_firms,(I.sum(),k))
+        
+        # d. rounds in random order
+        order = rng.permuted(np.tile(np.arange(par.n_persons),(k,1)),axis=1)
+        
+        return order.ravel(), partners[order,np.arange(k)[:,None]].ravel()
+
+
+class simulation_result:
+    """Series of a simulation, in columns preallocated for all days
+
+    A column (e.g. result.price or result["price"]) is a view with one value per simulated day. 
+    Iterating over the result gives the columns in the order of names, so it unpacks like a tuple of the series.
+    """
+
+    def __init__(self,names,size,path=None):
+        """
+        Parameters:
+
+        names: list; names of the series, see economy_simulation.series_names
+        size: int; number of days to allocate
+        path: str; If given, the columns are stored in a memory-mapped .npy file at path instead of in memory.
+            The file is cut to the simulated days by trim. Only this result writes to it: its copies 
+            (e.g. in a checkpoint) are kept in memory, and its views do not trim.
+        """
+
+        dtype = np.dtype([(name,np.float64) for name in names])
+        
+        if path is None:
+            self.data = np.empty(size,dtype)
+        else:
+            self.data = np.lib.format.open_memmap(path,mode="w+",dtype=dtype,shape=(size,))
+            for name in names: # (days that are not simulated yet are nan)
+                self.data[name] = np.nan
+        
+        self.path = path
+        self.n_days = 0
+
+    @property
+    def names(self):
+        return list(self.data.dtype.names)
+
+    def __getattr__(self,name):
+
+        if name != "data" and name in self.data.dtype.names:
+            return self[name]
+        
+        raise AttributeError(name)
+
+    def __getstate__(self):
+
+        # (copies and pickles are kept in memory, so they never write to the file of this result)
+        state = dict(self.__dict__,path=None)
+        if isinstance(self.data,np.memmap):
+            state["data"] = np.array(self.data)
+
+        return state
+
+    def __getitem__(self,key):
+
+        if not isinstance(key,str):
+            key = self.names[key]
+
+        return self.data[key][:self.n_days]
+
+    def __iter__(self):
+        return (self[name] for name in self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __array__(self,dtype=None,copy=None):
+        """All series as a (len(names),n_days) array"""
+
+        return np.array([self[name] for name in self.names],dtype=dtype)
+
+    def append(self,day):
+        """Stores the series of one day (a namespace, see economy_simulation.simulation_days)"""
+
+        if self.n_days == self.data.size:
+            self.reserve(2*self.n_days)
+
+        row = self.data[self.n_days]
+        for name in self.names:
+            row[name] = getattr(day,name)
+
+        self.n_days += 1
+
+    def reserve(self,size):
+        """Makes room for size days (a memory-mapped result grows its file)"""
+
+        if size > self.data.size:
             
+            if self.path is None:
+                data = np.empty(size,self.data.dtype)
+                data[:self.n_days] = self.data[:self.n_days]
+                self.data = data
             
+            else:
+                self._remap(size)
 
-            
+    def trim(self):
+        """Cuts the file of a memory-mapped result to the simulated days, so that load only gives those"""
+
+        if self.path is not None and self.n_days < self.data.size:
+            self._remap(self.n_days)
+
+    def _remap(self,size):
+        """Moves the simulated days to a new file for size days, which replaces the file at path
+        
+        Maps of the old file (e.g. in views) stay valid.
+        """
+
+        # a. new file
+        temp = self.path + ".tmp"
+        data = np.lib.format.open_memmap(temp,mode="w+",dtype=self.data.dtype,shape=(size,))
+        data[:self.n_days] = self.data[:self.n_days]
+        for name in self.names: # (days that are not simulated yet are nan)
+            data[name][self.n_days:] = np.nan
         
-                    
\ No newline at end of file
+        # b. replace the old one
+        data.flush()
+        os.replace(temp,self.path)
+        self.data = data
+
+    def view(self,n_days=None):
+        """Result with the first n_days days (default all), sharing the columns"""
+
+        view = simulation_result.__new__(simulation_result)
+        view.__dict__.update(self.__dict__,path=None)
+        view.n_days = self.n_days if n_days is None else min(n_days,self.n_days)
+
+        return view
+
+    def to_frame(self):
+        """The series as a DataFrame, indexed by day"""
+
+        frame = pd.DataFrame(self.data[:self.n_days])
+        frame.index.name = "day"
+
+        return frame
+
+    def save(self,path):
+        """Saves the series to path: compressed if it ends with .npz, else as a .npy file that load can memory-map"""
+
+        if path.endswith(".npz"):
+            np.savez_compressed(path,**{name:self[name] for name in self.names})
+        else:
+            np.save(path,self.data[:self.n_days])
+
+    @staticmethod
+    def load(path,mmap=True):
+        """Loads a result saved by save (or written through the path of economy_simulation.simulation)
+
+        A .npy file is memory-mapped if mmap is True, so the columns are read from disk only when used.
+        """
+
+        if path.endswith(".npz"):
+            with np.load(path) as file:
+                columns = {name:file[name] for name in file.files}
+            result = simulation_result(list(columns),len(next(iter(columns.values()))))
+            for name,values in columns.items():
+                result.data[name] = values
+        
+        else:
+            result = simulation_result([],0)
+            result.data = np.load(path,mmap_mode="r" if mmap else None)
+
+        result.n_days = result.data.size
+
+        return result
+
+class simulation_cache:
+    """Least recently used cache of simulation results, bounded to maxsize entries"""
+
+    def __init__(self,maxsize=32):
+
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,key):
+        """Entry for key (None if missing), marking it as recently used"""
+
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        
+        self.misses += 1
+        return None
+
+    def put(self,key,entry):
+        """Stores entry, evicting the least recently used entries when full"""
+
+        if self.maxsize <= 0:
+            return
+
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all entries and resets the statistics"""
+
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# economy simulated by the processes of economy_simulation.ensemble
+_ensemble_economy = None
+
+def _init_ensemble(economy):
+    """Stores the economy in a process of economy_simulation.ensemble"""
+
+    global _ensemble_economy
+    _ensemble_economy = economy
+
+def _run_ensemble(seed):
+    """One run of economy_simulation.ensemble"""
+
+    return _ensemble_economy._seeded_run(seed)
+
+def _steady(recent,tol):
+    """True if every series in recent (rows of days) stays in a band of relative width tol"""
+
+    values = np.array(recent,dtype=float)
+    band = values.max(axis=0) - values.min(axis=0)
+
+    return bool(np.all(band <= tol*np.abs(values.mean(axis=0))))
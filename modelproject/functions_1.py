@@ -1,7 +1,10 @@
+from types import SimpleNamespace
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import ipywidgets as widgets
-from class_1 import economy_simulation
+from IPython.display import display
+from class_1 import economy_simulation, simulation_cache
 
 def trade(buyer,seller,do_print=False):
     """
@@ -86,6 +89,227 @@ def labor_market(worker,employer,inflation,do_print=False):
     # g. output
     return w
 
+def trade_arrays(buyers,sellers,b,s):
+    """
+    Will make the interactions between the buyers b[k] and sellers s[k] in the goods market, in the order k = 0,1,...
+    
+    buyers and sellers are class_1.person_arrays and class_1.firm_arrays. 
+    The result is the same as calling trade on every pair in turn. Returns the list of prices of the successful trades.
+    """
+
+    # a. price expected by the buyers and set by the sellers, kept until they trade
+    met_b = np.bincount(b,minlength=buyers.id.size) > 0
+    met_s = np.bincount(s,minlength=sellers.id.size) > 0
+    buyers.curr_p[met_b] = np.minimum(buyers.curr_p[met_b],buyers.max_p[met_b])
+    sellers.curr_p[met_s] = np.maximum(sellers.curr_p[met_s],sellers.min_p[met_s])
+
+    # b. pairs where a trade is possible, and the ones that happen
+    k = np.flatnonzero((sellers.curr_p[s] <= buyers.curr_p[b]) & ~sellers.sold[s] & ~buyers.bought[b])
+    k = k[greedy_matching(b[k],s[k],buyers.id.size,sellers.id.size)]
+
+    # c. output
+    return _settle_trades(buyers,sellers,b[k],s[k])
+
+def _settle_trades(buyers,sellers,b,s):
+    """
+    Makes the trades between the buyers b[k] and sellers s[k] at the sellers' prices (as in trade).
+    Returns the list of prices.
+    """
+
+    # a. accounting
+    p = sellers.curr_p[s]
+    buyers.p_curr_surplus[b] = buyers.max_p[b] - p
+    sellers.p_curr_surplus[s] = p - sellers.min_p[s]
+    buyers.bought[b] = True
+    sellers.sold[s] = True
+
+    # b. price adjustments (person decreases and firm increases)
+    buyers.curr_p[b] -= 1
+    sellers.curr_p[s] += 1
+
+    # c. output
+    return p.tolist()
+
+def labor_market_arrays(workers,employers,w,e,inflation):
+    """
+    Will make the interactions between the workers w[k] and employers e[k] in the labor market, in the order k = 0,1,...
+    
+    workers and employers are class_1.person_arrays and class_1.firm_arrays. 
+    The result is the same as calling labor_market on every pair in turn. Returns the list of wages of the successful interactions.
+    """
+
+    # a. nominal wages expected by the workers and set by the employers, kept until they are matched
+    met_w = np.bincount(w,minlength=workers.id.size) > 0
+    met_e = np.bincount(e,minlength=employers.id.size) > 0
+    workers.curr_w[met_w] = np.maximum(workers.curr_w[met_w],np.trunc(workers.min_rw[met_w]*inflation)+1)
+    employers.curr_w[met_e] = np.minimum(employers.curr_w[met_e],np.trunc(employers.max_rw[met_e]*inflation))
+
+    # b. pairs where an interaction can succeed, and the ones that do
+    k = np.flatnonzero((workers.curr_w[w] <= employers.curr_w[e]) & ~employers.employed[e] & ~workers.worked[w])
+    k = k[greedy_matching(w[k],e[k],workers.id.size,employers.id.size)]
+
+    # c. output
+    return _settle_labor(workers,employers,w[k],e[k],inflation)
+
+def _settle_labor(workers,employers,w,e,inflation):
+    """
+    Matches the workers w[k] and employers e[k] at the employers' wages (as in labor_market).
+    Returns the list of wages.
+    """
+
+    # a. accounting
+    wage = employers.curr_w[e]
+    workers.rw_curr_surplus[w] = wage - workers.min_rw[w]*inflation
+    employers.rw_curr_surplus[e] = employers.max_rw[e]*inflation - wage
+    employers.employed[e] = True
+    workers.worked[w] = True
+
+    # b. wage adjustments (person increases and firm decreases)
+    employers.curr_w[e] -= 1
+    workers.curr_w[w] += 1
+
+    # c. output
+    return wage.tolist()
+
+def order_book_trade(buyers,sellers):
+    """
+    Will clear the goods market in an order book: the highest bid meets the lowest ask, the second 
+    highest bid the second lowest ask and so on, for as long as the bid is at least the ask.
+
+    buyers and sellers are lists of class_1.person and class_1.firm. Every pair trades as in trade.
+    Returns the list of prices of the trades.
+    """
+
+    # a. price expected by the buyers and set by the sellers
+    for buyer in buyers:
+        buyer.curr_p = min(buyer.curr_p,buyer.max_p)
+    
+    for seller in sellers:
+        seller.curr_p = max(seller.curr_p,seller.min_p)
+
+    # b. order book (ties keep the order of the agents)
+    bids = sorted(buyers,key=lambda buyer: buyer.curr_p,reverse=True)
+    asks = sorted(sellers,key=lambda seller: seller.curr_p)
+
+    # c. trades
+    p_list = []
+    for buyer, seller in zip(bids,asks):
+        p = trade(buyer,seller)
+        
+        if str(p) == "nan":
+            break
+        
+        p_list.append(p)
+
+    # d. output
+    return p_list
+
+def order_book_labor_market(workers,employers,inflation):
+    """
+    Will clear the labor market in an order book: the lowest wage asked by a worker meets the highest
+    wage offered by an employer and so on, for as long as the offer is at least the ask.
+
+    workers and employers are lists of class_1.person and class_1.firm. Every pair interacts as in labor_market.
+    Returns the list of wages of the matches.
+    """
+
+    # a. nominal wage expected by the workers and set by the employers
+    for worker in workers:
+        worker.curr_w = max(worker.curr_w,int(worker.min_rw*inflation)+1)
+    
+    for employer in employers:
+        employer.curr_w = min(employer.curr_w,int(employer.max_rw*inflation))
+
+    # b. order book (ties keep the order of the agents)
+    asks = sorted(workers,key=lambda worker: worker.curr_w)
+    bids = sorted(employers,key=lambda employer: employer.curr_w,reverse=True)
+
+    # c. matches
+    w_list = []
+    for worker, employer in zip(asks,bids):
+        w = labor_market(worker,employer,inflation)
+        
+        if str(w) == "nan":
+            break
+        
+        w_list.append(w)
+
+    # d. output
+    return w_list
+
+def order_book_trade_arrays(buyers,sellers):
+    """
+    Will clear the goods market in an order book, as order_book_trade, for class_1.person_arrays and class_1.firm_arrays.
+    Returns the list of prices of the trades.
+    """
+
+    # a. price expected by the buyers and set by the sellers
+    np.minimum(buyers.curr_p,buyers.max_p,out=buyers.curr_p)
+    np.maximum(sellers.curr_p,sellers.min_p,out=sellers.curr_p)
+
+    # b. order book (ties keep the order of the agents)
+    b = np.argsort(-buyers.curr_p,kind="stable")
+    s = np.argsort(sellers.curr_p,kind="stable")
+    n = min(b.size,s.size)
+    n = np.sum(sellers.curr_p[s[:n]] <= buyers.curr_p[b[:n]])
+
+    # c. output
+    return _settle_trades(buyers,sellers,b[:n],s[:n])
+
+def order_book_labor_market_arrays(workers,employers,inflation):
+    """
+    Will clear the labor market in an order book, as order_book_labor_market, for class_1.person_arrays and class_1.firm_arrays.
+    Returns the list of wages of the matches.
+    """
+
+    # a. nominal wage expected by the workers and set by the employers
+    np.maximum(workers.curr_w,np.trunc(workers.min_rw*inflation)+1,out=workers.curr_w)
+    np.minimum(employers.curr_w,np.trunc(employers.max_rw*inflation),out=employers.curr_w)
+
+    # b. order book (ties keep the order of the agents)
+    w = np.argsort(workers.curr_w,kind="stable")
+    e = np.argsort(-employers.curr_w,kind="stable")
+    n = min(w.size,e.size)
+    n = np.sum(workers.curr_w[w[:n]] <= employers.curr_w[e[:n]])
+
+    # c. output
+    return _settle_labor(workers,employers,w[:n],e[:n],inflation)
+
+def greedy_matching(a,b,n_a,n_b):
+    """
+    Returns the indices k of the pairs (a[k],b[k]) that are matched when going through the pairs 
+    in order and matching every pair where neither a[k] nor b[k] has been matched before.
+
+    It is done in rounds: a pair that comes first among the remaining pairs of both its members 
+    is matched, and the remaining pairs of matched members are dropped. This gives the same 
+    matching as going through the pairs one by one.
+    """
+
+    # a. remaining pairs
+    k = np.arange(a.size)
+    matched = []
+
+    while k.size > 0:
+        
+        # i. first remaining pair of every member
+        first_a = np.full(n_a,a.size)
+        first_b = np.full(n_b,b.size)
+        np.minimum.at(first_a,a[k],k)
+        np.minimum.at(first_b,b[k],k)
+
+        # ii. match the pairs that come first for both
+        new = k[(first_a[a[k]] == k) & (first_b[b[k]] == k)]
+        matched.append(new)
+
+        # iii. drop the pairs of matched members
+        done_a = np.zeros(n_a,dtype=bool)
+        done_b = np.zeros(n_b,dtype=bool)
+        done_a[a[new]] = True
+        done_b[b[new]] = True
+        k = k[~done_a[a[k]] & ~done_b[b[k]]]
+
+    return np.sort(np.concatenate(matched)) if matched else k
+
 def plot_func(p_dem_func=None, p_sup_func=None,initial_p=None, rw_dem_func=None, rw_sup_func=None, initial_w=None , n_days=30, n_persons=25, n_firms=25,only_goods=False,only_labor=False):
     """
     Will plot the desired markets' results according to our model.
@@ -95,7 +319,19 @@ def plot_func(p_dem_func=None, p_sup_func=None,initial_p=None, rw_dem_func=None,
     # a. simulate economy
     par = economy_simulation(p_dem_func, p_sup_func,initial_p, rw_dem_func, rw_sup_func, initial_w, n_days, n_persons, n_firms,only_goods,only_labor).simulation()
     
-    # b. choose the correct unpacking
+    # b. plot
+    draw_lines(plt.figure(),_lines(par,initial_p,n_days,only_goods,only_labor),n_days,only_goods,only_labor)
+
+    # c. show the plot
+    plt.tight_layout()
+    plt.show()
+
+def _lines(par,initial_p,n_days,only_goods=False,only_labor=False):
+    """
+    The values of every line of the plot of the simulation results par, in the order draw_lines draws them.
+    """
+
+    # a. choose the correct unpacking
     if only_goods:
         price,g_demand, g_supply = par
     elif only_labor:
@@ -103,18 +339,38 @@ def plot_func(p_dem_func=None, p_sup_func=None,initial_p=None, rw_dem_func=None,
         price = [initial_p for i in range(n_days)]
     else:
         price,g_demand, g_supply, wage, l_demand, l_supply = par
+
+    lines = []
+
+    # b. goods market
+    if not only_labor:
+        lines += [price,g_demand,g_supply]
+
+    # c. labor market, with the real wage
+    if not only_goods:
+        lines += [wage,l_demand,l_supply,np.array(wage)/np.array(price)]
+
+    return lines
+
+def draw_lines(fig,lines,n_days,only_goods=False,only_labor=False):
+    """
+    Draws the lines (see _lines) of the desired markets in fig, and returns the axes and lines to update them with update_lines.
+    """
+
+    values = iter(lines)
+    plot = SimpleNamespace(fig=fig,axes=[],lines=[])
     
-    # c. create figure and subplots
-    fig, axs = plt.subplots(2,2)
+    # a. create subplots
+    axs = fig.subplots(2,2)
 
     r = 0
-    # d. if the goods market is allowed
+    # b. if the goods market is allowed
     if not only_labor:
         
         # i. plotting
-        axs[r,0].plot(range(n_days),price,color="darkcyan",alpha=0.7)
-        axs[r,1].plot(range(n_days),g_demand,color="red",alpha=0.7)
-        axs[r,1].plot(range(n_days),g_supply,color="darkcyan",alpha=0.7)
+        plot.lines += axs[r,0].plot(range(n_days),next(values),color="darkcyan",alpha=0.7)
+        plot.lines += axs[r,1].plot(range(n_days),next(values),color="red",alpha=0.7)
+        plot.lines += axs[r,1].plot(range(n_days),next(values),color="darkcyan",alpha=0.7)
 
         # ii. setting tittles
         axs[r,0].set_title("Price")
@@ -130,45 +386,58 @@ def plot_func(p_dem_func=None, p_sup_func=None,initial_p=None, rw_dem_func=None,
         # v. setting the x-label
         axs[r,0].set_xlabel("Day",rotation="horizontal",fontweight='bold')
         axs[r,1].set_xlabel("Day",rotation="horizontal",fontweight='bold')
+        plot.axes += [axs[r,0],axs[r,1]]
         r += 1
 
     if not only_goods:
         
-        # i. calculate real wage array
-        rw = np.array(wage)/np.array(price)
-
-        # ii. plotting
-        axs[r,0].plot(range(n_days),wage,color="red",alpha=0.7)
-        axs[r,1].plot(range(n_days),l_demand,color="red",alpha=0.7)
-        axs[r,1].plot(range(n_days),l_supply,color="darkcyan",alpha=0.7)
+        # i. plotting
+        plot.lines += axs[r,0].plot(range(n_days),next(values),color="red",alpha=0.7)
+        plot.lines += axs[r,1].plot(range(n_days),next(values),color="red",alpha=0.7)
+        plot.lines += axs[r,1].plot(range(n_days),next(values),color="darkcyan",alpha=0.7)
         ax = axs[r,0].twinx() 
-        ax.plot(range(n_days),rw,color="darkcyan",alpha=0.7,linestyle="-.")
+        plot.lines += ax.plot(range(n_days),next(values),color="darkcyan",alpha=0.7,linestyle="-.")
         
-        # iii. setting tittles
+        # ii. setting tittles
         axs[r,0].set_title("Real and Nominal wage")
         axs[r,1].set_title("Demand and Supply")
         
-        # iv. adding legends
+        # iii. adding legends
         axs[r,1].legend(["Labor Demand","Labor Supply"],fontsize=6)
         axs[r,0].legend(["Nominal Wage"],fontsize=6,loc="upper left")
         ax.legend(["Real wage"],loc="lower right",fontsize=6)
 
-        # v. setting the y-label
+        # iv. setting the y-label
         axs[r,0].set_ylabel("nw",rotation="horizontal",fontweight='bold')
         axs[r,1].set_ylabel("Q",rotation="horizontal",fontweight='bold')
         ax.set_ylabel("rw",rotation="horizontal",fontweight='bold')
         
-        # vi. setting the x-label
+        # v. setting the x-label
         axs[r,0].set_xlabel("Day",rotation="horizontal",fontweight='bold')
         axs[r,1].set_xlabel("Day",rotation="horizontal",fontweight='bold')
+        plot.axes += [axs[r,0],axs[r,1],ax]
     
     if only_goods or only_labor:
         fig.delaxes(axs[1,0])
         fig.delaxes(axs[1,1])
 
-    # e. show the plot
-    plt.tight_layout()
-    plt.show()
+    return plot
+
+def update_lines(plot,lines,n_days):
+    """
+    Replaces the values of the lines drawn by draw_lines, rescaling the axes, without redrawing the figure.
+    """
+
+    # a. new values
+    for line,values in zip(plot.lines,lines):
+        line.set_data(range(n_days),values)
+
+    # b. rescale
+    for ax in plot.axes:
+        ax.relim()
+        ax.autoscale_view()
+
+    plot.fig.canvas.draw_idle()
 
 def stand_func(ab, n_persons=None, n_firms=None, dem=False, sup=False):
     """
@@ -206,18 +475,76 @@ def stand_func(ab, n_persons=None, n_firms=None, dem=False, sup=False):
     # f. output
     return function
 
-def create_curves(p_dem,p_sup,l_dem,l_sup,n_persons,n_firms,initial_p, initial_w, n_days):
+def create_curves(p_dem,p_sup,l_dem,l_sup,n_persons,n_firms,initial_p, initial_w, n_days, seed=None):
     """
     Will create all the curves and simulate them.
+    With a seed, the results are kept in simulations, an LRU cache, so parameters seen before are not simulated again.
+    The figure of the previous call is updated instead of drawing a new one.
     """
-    # a. create all functions
-    p_dem_func = stand_func(p_dem, n_persons=n_persons, dem=True)
-    p_sup_func = stand_func(p_sup, n_firms=n_firms, sup=True) 
-    l_dem_func = stand_func(l_dem, n_firms=n_firms, dem=True)
-    l_sup_func = stand_func(l_sup, n_persons=n_persons, sup=True)
+    global _plot
+
+    # a. create the economy with all functions
+    def economy():
+        p_dem_func = stand_func(p_dem, n_persons=n_persons, dem=True)
+        p_sup_func = stand_func(p_sup, n_firms=n_firms, sup=True) 
+        l_dem_func = stand_func(l_dem, n_firms=n_firms, dem=True)
+        l_sup_func = stand_func(l_sup, n_persons=n_persons, sup=True)
+
+        return economy_simulation(p_dem_func, p_sup_func, initial_p, l_dem_func, l_sup_func, initial_w, n_days, n_persons, n_firms, seed=seed)
+
+    # b. simulate (or look up) the economy
+    if seed is None:
+        par = economy().simulation()
+    else:
+        key = (p_dem,p_sup,l_dem,l_sup,n_persons,n_firms,initial_p,initial_w,seed)
+        par = _cached_simulation(key,n_days,economy)
+
+    # c. plot the results of the simulation
+    lines = _lines(par,initial_p,n_days)
+
+    if _plot is None:
+        _plot = draw_lines(Figure(),lines,n_days)
+        _plot.fig.tight_layout()
+    else:
+        update_lines(_plot,lines,n_days)
+
+    display(_plot.fig)
+
+# simulation results of create_curves, and the figure it updates
+simulations = simulation_cache(32)
+_plot = None
+
+def _cached_simulation(key,n_days,economy):
+    """
+    Series of economy() over n_days, from simulations if possible.
+    A cached run of the same economy over more days is cut, and one over fewer days is extended (see economy_simulation.extend).
+    """
+
+    # a. the same run
+    entry = simulations.get(key+(n_days,))
+    if entry is not None:
+        return entry.series
+
+    # b. runs over other numbers of days (the days are the last element of the keys)
+    days = [k[-1] for k in simulations.entries if k[:-1] == key]
+    longer = [d for d in days if d > n_days]
+    shorter = [d for d in days if d < n_days]
+
+    if longer:
+        entry = simulations.get(key+(min(longer),))
+        return entry.series.view(n_days)
+
+    # c. simulate the missing days
+    model = economy()
+    if shorter:
+        entry = simulations.get(key+(max(shorter),))
+        series = model.extend(n_days-max(shorter),checkpoint=entry.checkpoint)
+    else:
+        series = model.simulation()
+
+    simulations.put(key+(n_days,),SimpleNamespace(series=series,checkpoint=model.checkpoint()))
 
-    # b. plot the results of the simulation
-    plot_func(p_dem_func=p_dem_func, p_sup_func=p_sup_func,initial_p=initial_p, rw_dem_func=l_dem_func, rw_sup_func=l_sup_func, initial_w=initial_w , n_days=n_days, n_persons=n_persons, n_firms=n_firms,only_goods=False,only_labor=False)
+    return series
 
 
 def interact():
@@ -236,9 +563,10 @@ def interact():
     initial_p = widgets.IntSlider(75, 10, 90)
     initial_w = widgets.IntSlider(25, 10, 90)
     n_days = widgets.IntSlider(100, 50, 500, 10)
+    seed = widgets.IntText(0)
     
     # c. make them interact within the simulation
-    widgets.interact(create_curves, p_dem=p_dem, p_sup=p_sup, l_dem=l_dem, l_sup=l_sup, n_persons=n_persons, n_firms=n_firms, initial_p=initial_p, initial_w=initial_w, n_days=n_days)
+    widgets.interact(create_curves, p_dem=p_dem, p_sup=p_sup, l_dem=l_dem, l_sup=l_sup, n_persons=n_persons, n_firms=n_firms, initial_p=initial_p, initial_w=initial_w, n_days=n_days, seed=seed)
 
 
 